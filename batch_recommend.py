@@ -0,0 +1,200 @@
+"""
+Transfer recommendations for many FPL teams at once, e.g. a whole league, written to one csv file
+
+    python batch_recommend.py 123456 234567 --out recommendations.csv
+    python batch_recommend.py --ids-file league.txt --fetch-workers 16 --rate 10
+
+Picks are fetched from the public API (no login needed) concurrently over one pooled, rate limited HTTP session,
+every team is solved in the shared squad_solver process pool and all of them use the same bootstrap snapshot.
+Set --base-url http://localhost:8765 to run against fpl_stub_server.py.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fpldata import FPLData
+from get_data import FPL_MODE, RECORD_DIR, get_player_table, wrap_fpl
+from squad_solver import build_squad_model, objective_vector, prune_dominated, submit_solve
+
+FPL_URL = "https://fantasy.premierleague.com"
+DEFAULT_WEIGHTS = dict(total_points=10, now_cost=1, ep_next=5, form=3, selected_by_percent=3, bonus=1,
+                       dreamteam_count=1)  # same defaults as the sliders of the transfer pages
+SQUAD_PLAYERS = {'Goalkeeper': (2, 2), 'Defender': (5, 5), 'Midfielder': (5, 5), 'Forward': (3, 3)}
+SQUAD_TOTAL_PLAYERS = 15
+PLAYERS_PER_TEAM = 3
+
+
+class RateLimiter:
+    """ Spaces the calls of wait() from all threads at least 1 / rate seconds apart """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        time.sleep(at - now)
+
+
+class PublicFPL:
+    """
+    The public (no login) endpoints of the FPL API used by the batch, over one requests.Session
+    pool_size: connections kept open, at least the number of threads fetching
+    rate: max requests per second, retries back off on 429 and server errors
+    """
+
+    def __init__(self, base_url=FPL_URL, pool_size=8, rate=10, record=FPL_MODE == 'record', path=RECORD_DIR):
+        self.base_url = base_url.rstrip('/')
+        self.limiter = RateLimiter(rate)
+        self.record = record
+        self.path = path
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, endpoint):
+        self.limiter.wait()
+        r = self.session.get("{}/{}/".format(self.base_url, endpoint), timeout=30)
+        r.raise_for_status()
+        payload = r.json()
+        if self.record:
+            # the API payload under its own url, as RecordReplayFPL lays them out, so fpl_stub_server.py can serve it
+            fn = os.path.join(self.path, *endpoint.split('/')) + '.json'
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn, 'w') as f:
+                json.dump(payload, f)
+        return payload
+
+    def fetch_entry(self, team_id):
+        return self.get('api/entry/{}'.format(team_id))
+
+    def fetch_picks(self, team_id, event):
+        return self.get('api/entry/{}/event/{}/picks'.format(team_id, event))
+
+    def fetch_team(self, team_id, event):
+        """ Manager info and picks of team_id in event, as one dict """
+        return dict(team_id=team_id, entry=self.fetch_entry(team_id), picks=self.fetch_picks(team_id, event))
+
+
+def team_model(df, team, n_transfers, c):
+    """
+    Transfer model of one fetched team, as solve_transfers builds it for the transfer pages, without the dominated
+    players (see prune_dominated); returns (model, objective of the model columns, current_team)
+    """
+    elements = [p['element'] for p in team['picks']['picks']]
+    current_team = list(df.index[df.element.isin(elements)])
+    history = team['picks']['entry_history']
+    max_players_per_team = {t: PLAYERS_PER_TEAM for t in df.team_name.unique()}
+    keep = prune_dominated(df, [c], {p: v[1] for p, v in SQUAD_PLAYERS.items()}, SQUAD_TOTAL_PLAYERS,
+                           max_players_per_team, current_team=current_team)
+    model = build_squad_model(df=df[keep], budget=history['value'] + history['bank'],
+                              total_players=SQUAD_TOTAL_PLAYERS, players_minmax=SQUAD_PLAYERS,
+                              max_players_per_team=max_players_per_team, current_team=current_team,
+                              n_transfers=n_transfers)
+    return model, c[keep], current_team
+
+
+def result_row(df, team, current_team, result, n_transfers, free_transfers, transfers_cost):
+    entry = team['entry']
+    row = dict(team_id=team['team_id'], squad_name=entry.get('name'),
+               manager="{} {}".format(entry.get('player_first_name'), entry.get('player_last_name')),
+               n_transfers=n_transfers, status=result.status, solve_ms=1000 * result.seconds)
+    if result.codes is None:
+        return row
+
+    current = df.index.isin(current_team)
+    picked = df.index.isin(result.codes)
+    point_cost = max(0, (n_transfers - free_transfers) * transfers_cost)
+    ep_gain = df.ep_next.to_numpy()[picked].sum() - df.ep_next.to_numpy()[current].sum()
+    row.update(players_out=", ".join(df.web_name[current & ~picked]),
+               players_in=", ".join(df.web_name[picked & ~current]),
+               ep_gain=ep_gain, point_cost=point_cost, net_gain=ep_gain - point_cost)
+    return row
+
+
+def recommend(team_ids, api, df, game_week, n_transfers=1, free_transfers=1, transfers_cost=4, weights=None,
+              backend=None, fetch_workers=8):
+    """
+    Fetches every team concurrently and solves each one in the process pool as soon as its picks arrive
+    n_transfers, free_transfers: the public API does not expose free transfers, so the same is used for every team
+    Returns one row per team, failed fetches and infeasible teams included with their status
+    """
+    c = objective_vector(df, DEFAULT_WEIGHTS if weights is None else weights)
+    rows, solves = [], {}
+    picks_event = max(1, game_week - 1)  # before the first deadline there is no event 0, the picks are in event 1
+    with ThreadPoolExecutor(max_workers=fetch_workers) as fetcher:
+        fetches = {fetcher.submit(api.fetch_team, team_id, picks_event): team_id for team_id in team_ids}
+        for future in as_completed(fetches):
+            try:
+                team = future.result()
+            except (requests.RequestException, ValueError) as e:
+                rows.append(dict(team_id=fetches[future], status="fetch failed: {}".format(e)))
+                continue
+            model, c_team, current_team = team_model(df, team, n_transfers, c)
+            solves[submit_solve(model, c_team, backend=backend)] = (team, current_team)
+
+    for future in as_completed(solves):
+        team, current_team = solves[future]
+        rows.append(result_row(df, team, current_team, future.result(), n_transfers, free_transfers, transfers_cost))
+
+    columns = ['team_id', 'squad_name', 'manager', 'n_transfers', 'players_out', 'players_in', 'ep_gain', 'point_cost',
+               'net_gain', 'status', 'solve_ms']
+    return pd.DataFrame(rows, columns=columns).set_index('team_id').reindex(team_ids)
+
+
+def main(team_ids, out, base_url, fetch_workers, rate, n_transfers, free_transfers, transfers_cost, backend):
+    start = time.perf_counter()
+    players = get_player_table(wrap_fpl(FPLData(convert_to_dataframes=True)))
+    game_week, _ = players.version
+    df = players.frame()
+
+    api = PublicFPL(base_url=base_url, pool_size=fetch_workers, rate=rate)
+    df_results = recommend(team_ids, api, df, game_week, n_transfers=n_transfers, free_transfers=free_transfers,
+                           transfers_cost=transfers_cost, backend=backend, fetch_workers=fetch_workers)
+    df_results.to_csv(out)
+
+    seconds = time.perf_counter() - start
+    n_ok = int(df_results.players_in.notna().sum())
+    print("{} teams ({} solved) in {:.1f} s: {:.0f} teams per minute, results in {}".format(
+        len(df_results), n_ok, seconds, 60 * len(df_results) / seconds, out))
+    if n_ok > 0:
+        print("median solve {:.0f} ms".format(np.median(df_results.solve_ms.dropna())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('team_ids', nargs='*', type=int)
+    parser.add_argument('--ids-file', help="file with one team id per line")
+    parser.add_argument('--out', default='recommendations.csv')
+    parser.add_argument('--base-url', default=FPL_URL)
+    parser.add_argument('--fetch-workers', type=int, default=8, help="threads fetching picks")
+    parser.add_argument('--rate', type=float, default=10, help="max requests per second")
+    parser.add_argument('--n-transfers', type=int, default=1)
+    parser.add_argument('--free-transfers', type=int, default=1)
+    parser.add_argument('--transfers-cost', type=int, default=4)
+    parser.add_argument('--backend', default=None, help="solver backend, see squad_solver.SOLVER_BACKENDS")
+    args = parser.parse_args()
+
+    team_ids = list(args.team_ids)
+    if args.ids_file is not None:
+        with open(args.ids_file) as f:
+            team_ids += [int(line) for line in f if line.strip()]
+
+    main(list(dict.fromkeys(team_ids)), out=args.out, base_url=args.base_url, fetch_workers=args.fetch_workers,
+         rate=args.rate, n_transfers=args.n_transfers, free_transfers=args.free_transfers,
+         transfers_cost=args.transfers_cost, backend=args.backend)
@@ -0,0 +1,331 @@
+"""
+Benchmark of the optimizers on synthetic players (see synthetic_data.py): time and peak python memory of the squad
+solvers used by the pages, their model build, dominance pruning and LP preview, pick, get_squad_prod,
+combine_and_pick_top, squad_transfer and PlayerWeights
+
+    python benchmark.py --sizes 700 5000 50000 --repeat 5 --out benchmark.json
+    python benchmark.py --baseline benchmark.json --tolerance 0.2
+    python benchmark.py --recorded --cases build_pulp_legacy build_squad_model build_squad_model_pulp
+
+--recorded runs the cases on the bootstrap data recorded with ROBOKLOPP_FPL_MODE=record instead of --sizes.
+build_pulp_legacy, the pulp problem built with one generator expression per player as the pages used to do, only
+runs when asked for in --cases: it takes minutes at 50k players.
+
+With --baseline, every result is compared with the same case and size in the baseline file, and the ones slower (or
+using more memory) than the baseline by more than tolerance are reported as regressions; the exit code is then 1.
+Times are the best of repeat runs; peak memory is measured with tracemalloc in a separate run, so it counts numpy
+and pandas buffers but not the memory of the solver libraries. The squad solvers stop at --time-limit seconds, the
+gap of their last solve is in the results (0 when it was solved to optimality, None when no squad was found in time).
+"""
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pulp
+import scipy
+
+from functions import squad_transfer
+from get_data import RecordReplayFPL, _build_snapshot, get_player_table
+from new_team_config import MAX_POS
+from new_team_functions import combine_and_pick_top, get_squad_prod, pick
+from player_table import PlayerTable
+from squad_solver import (MAP_POS_NUM, SOLVER_BACKENDS, SolveResult, SquadSolver, build_lineup_bench_model,
+                          build_squad_model, lp_preview, objective_vector, prune_dominated, solve_squad_model, to_pulp)
+from synthetic_data import SIZES, make_info
+from weighting import PlayerWeights, weight_func
+
+WEIGHTS = dict(total_points=10, now_cost=1, ep_next=5, form=3, selected_by_percent=3, bonus=1, dreamteam_count=1)
+SQUAD_PLAYERS = {'Goalkeeper': (2, 2), 'Defender': (5, 5), 'Midfielder': (5, 5), 'Forward': (3, 3)}
+LINEUP_MINMAX = {'Goalkeeper': (1, 1), 'Defender': (3, 5), 'Midfielder': (3, 5), 'Forward': (1, 3)}
+PICK_GROUPS = {'Stars': dict(players={'Midfielder': 2, 'Forward': 1}, budget=360,
+                             weight_func=dict(add=dict(total_points=10, ep_next=5, selected_by_percent=3))),
+               'Core': dict(players={'Goalkeeper': 1, 'Defender': 4, 'Midfielder': 2, 'Forward': 1}, budget=480,
+                            weight_func=dict(add=dict(total_points=5, ep_next=5, form=3))),
+               'Bench': dict(players={'Goalkeeper': 1, 'Defender': 1, 'Midfielder': 1, 'Forward': 1}, budget=240,
+                             weight_func=dict(add=dict(total_points=3, now_cost=-2)))}
+PLAYER_WEIGHTS = dict(add=dict(ep_this=100, ep_next=70, now_cost=30, total_points=50, selected_by_percent=5,
+                               transfers_in_out=50, form=50),
+                      mult=dict(chance_of_playing_next_round=10))
+SOLVER_TIME_LIMIT = 30
+
+
+def players(n_players, seed=0):
+    """ PlayerTable frame of n_players synthetic players, as the pages get it, plus a weights column """
+    df_elements = _build_snapshot(make_info(n_players, seed=seed))[2]
+    df = PlayerTable.from_elements(df_elements, version=(0, 'synthetic-{}-{}'.format(n_players, seed))).frame()
+    df = df.copy()
+    w = weight_func(df, add=WEIGHTS)
+    df['weights'] = (w - w.min()) / (w.max() - w.min()) + 1e-3
+    return df
+
+
+def best_squad(df):
+    max_players_per_team = {team: 3 for team in df.team_name.unique()}
+    model = build_squad_model(df=df, budget=1000, total_players=15, players_minmax=SQUAD_PLAYERS,
+                              max_players_per_team=max_players_per_team)
+    return solve_squad_model(model, objective_vector(df, WEIGHTS)).codes
+
+
+def recorded_players():
+    """ PlayerTable frame of the recorded bootstrap data, with the same weights column as players() """
+    df = get_player_table(RecordReplayFPL(None, mode='replay')).frame().copy()
+    w = weight_func(df, add=WEIGHTS)
+    df['weights'] = (w - w.min()) / (w.max() - w.min()) + 1e-3
+    return df
+
+
+def transfer_model_args(df):
+    """ Inputs of the transfer model of the pages, for a squad of cheap players and 2 transfers """
+    return dict(budget=1000, total_players=15, players_minmax=SQUAD_PLAYERS,
+                current_team=best_squad(df[df.now_cost < df.now_cost.median()]),
+                max_players_per_team={team: 3 for team in df.team_name.unique()}, n_transfers=2)
+
+
+def legacy_pulp_build(df, current_team, n_transfers, budget, total_players, players_minmax, max_players_per_team):
+    """ The transfer model as the pages built it before build_squad_model: one generator expression per player """
+    model = pulp.LpProblem(name="legacy", sense=pulp.LpMaximize, )
+    codes = df.index.to_list()
+    group = pulp.LpVariable.dict("group", codes, 0, 1, cat=pulp.LpInteger)
+
+    model += (sum(df.now_cost.loc[c] * group[c] for c in codes) <= budget, "Lineup budget")
+    model += (sum(group[c] for c in codes) == total_players, "Max {} lineup".format(total_players))
+    for player_type in players_minmax:
+        min_val, max_val = players_minmax[player_type]
+        element_type = MAP_POS_NUM[player_type]
+        model += (sum(group[c] for c in codes if df.element_type.loc[c] == element_type) == min_val,
+                  "Val {} {} in lineup".format(min_val, player_type))
+    for team in df.team_name.unique():
+        model += (sum(group[c] for c in codes if df.team_name.loc[c] == team) <= max_players_per_team[team],
+                  "Max {} players per team in {}".format(max_players_per_team[team], team))
+    model += (sum(df.chance_of_playing_next_round.loc[c] * group[c] for c in codes) == 100 * total_players,
+              "Chance of playing next round is 100%")
+    model += (sum(group[c] for c in current_team) == total_players - n_transfers,
+              "Keeping all by {} players".format(n_transfers))
+    model += pulp.lpSum([w * df[col].loc[c] * group[c] for col, w in WEIGHTS.items()] for c in codes)
+    return model
+
+
+# every case takes the players and the solver time limit, and returns the function to time, so its setup is not timed
+
+def case_solve_group_transfers(df, time_limit):
+    model_args = transfer_model_args(df)
+    c = objective_vector(df, WEIGHTS)
+    return lambda: SquadSolver(build_squad_model(df=df, **model_args), key=None).solve(c, time_limit=time_limit)
+
+
+def case_build_pulp_legacy(df, time_limit):
+    model_args = transfer_model_args(df)
+    return lambda: legacy_pulp_build(df, **model_args)
+
+
+def case_build_squad_model(df, time_limit):
+    model_args = transfer_model_args(df)
+    return lambda: build_squad_model(df=df, **model_args)
+
+
+def case_build_squad_model_pulp(df, time_limit):
+    model_args = transfer_model_args(df)
+    c = objective_vector(df, WEIGHTS)
+    return lambda: to_pulp(build_squad_model(df=df, **model_args), c)
+
+
+def build_and_solve(backend):
+    """ Case of the transfer model built and solved with backend, without the warm start of the pages """
+    def case(df, time_limit):
+        model_args = transfer_model_args(df)
+        c = objective_vector(df, WEIGHTS)
+        return lambda: solve_squad_model(build_squad_model(df=df, **model_args), c, backend=backend,
+                                         time_limit=time_limit)
+
+    return case
+
+
+def case_solve_group_new_team(df, time_limit):
+    model_args = dict(squad_budget=1000, lineup_budget=830, squad_players={p: v[0] for p, v in SQUAD_PLAYERS.items()},
+                      lineup_minmax=LINEUP_MINMAX, max_players_per_team={team: 3 for team in df.team_name.unique()})
+    c = np.concatenate([objective_vector(df, WEIGHTS), objective_vector(df, dict(now_cost=-1, total_points=1))])
+    return lambda: SquadSolver(build_lineup_bench_model(df=df, **model_args), key=None).solve(c, time_limit=time_limit)
+
+
+def case_lp_preview_new_team(df, time_limit):
+    model = build_lineup_bench_model(df=df, squad_budget=1000, lineup_budget=830,
+                                     squad_players={p: v[0] for p, v in SQUAD_PLAYERS.items()},
+                                     lineup_minmax=LINEUP_MINMAX,
+                                     max_players_per_team={team: 3 for team in df.team_name.unique()})
+    c = np.concatenate([objective_vector(df, WEIGHTS), objective_vector(df, dict(now_cost=-1, total_points=1))])
+    return lambda: lp_preview(model, c)
+
+
+def case_prune_dominated(df, time_limit):
+    max_players_per_team = {team: 3 for team in df.team_name.unique()}
+    objectives = [objective_vector(df, WEIGHTS), objective_vector(df, dict(now_cost=-1, total_points=1))]
+    return lambda: prune_dominated(df, objectives, {p: v[1] for p, v in SQUAD_PLAYERS.items()}, 15,
+                                   max_players_per_team)
+
+
+def case_pick(df, time_limit):
+    team_budget = {team: 3 for team in df.team_code.unique()}
+    return lambda: pick(df, weights='weights', cost='now_cost', budget=1000, positions=MAX_POS, team_budget=team_budget)
+
+
+def _pick_groups_df(df):
+    df = df.copy()
+    for group, config in PICK_GROUPS.items():
+        w = weight_func(df, **config['weight_func'])
+        df['w_' + group] = (w - w.min()) / (w.max() - w.min()) + 1e-3
+    return df
+
+
+def case_get_squad_prod(df, time_limit):
+    df = _pick_groups_df(df)
+    team_budget = {team: 3 for team in df.team_code.unique()}
+    return lambda: get_squad_prod(df, list(PICK_GROUPS), PICK_GROUPS, team_budget, top_n=5, ndraws_per_group=50,
+                                  rng=np.random.default_rng(0))
+
+
+def case_combine_and_pick_top(df, time_limit):
+    df = _pick_groups_df(df)
+    team_budget = {team: 3 for team in df.team_code.unique()}
+    comb_squad = get_squad_prod(df, list(PICK_GROUPS), PICK_GROUPS, team_budget, top_n=10, ndraws_per_group=50,
+                                rng=np.random.default_rng(0))
+    return lambda: combine_and_pick_top(comb_squad, by_order=['ep_next', 'points'], top_n=10)
+
+
+def case_squad_transfer(df, time_limit):
+    squad = df.loc[best_squad(df[df.now_cost < df.now_cost.median()])]
+    teams = (3 - squad.team.value_counts()).reindex(df.team.unique(), fill_value=3).to_dict()
+    return lambda: squad_transfer(df, squad, teams, top_n=10, extra_budget=5)
+
+
+def case_player_weights(df, time_limit):
+    return lambda: PlayerWeights(df, weight_func_args=PLAYER_WEIGHTS).apply()
+
+
+CASES = dict(solve_group_transfers=case_solve_group_transfers,
+             solve_group_new_team=case_solve_group_new_team,
+             lp_preview_new_team=case_lp_preview_new_team,
+             prune_dominated=case_prune_dominated,
+             pick=case_pick,
+             get_squad_prod=case_get_squad_prod,
+             combine_and_pick_top=case_combine_and_pick_top,
+             squad_transfer=case_squad_transfer,
+             player_weights=case_player_weights,
+             build_pulp_legacy=case_build_pulp_legacy,
+             build_squad_model=case_build_squad_model,
+             build_squad_model_pulp=case_build_squad_model_pulp,
+             **{'build_and_solve_{}'.format(name.split()[0].lower()): build_and_solve(name)
+                for name in SOLVER_BACKENDS})
+SLOW_CASES = ['build_pulp_legacy']  # only run when asked for in --cases
+
+
+def measure(f, repeat):
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t)
+
+    gc.collect()
+    tracemalloc.start()
+    out = f()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    res = dict(seconds=min(times), seconds_median=float(np.median(times)), peak_mb=peak / 2 ** 20)
+    if isinstance(out, SolveResult):
+        res['gap'] = out.gap if out.codes is not None else None
+    return res
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, cases, repeat, time_limit=SOLVER_TIME_LIMIT, seed=0, recorded=False):
+    """ sizes: numbers of synthetic players, ignored when recorded is set (the recorded bootstrap data is used) """
+    results = []
+    frames = [recorded_players()] if recorded else (players(n_players, seed=seed) for n_players in sizes)
+    for df in frames:
+        n_players = len(df)
+        for name in cases:
+            res = dict(case=name, players=n_players, repeat=repeat)
+            res.update(measure(CASES[name](df, time_limit), repeat))
+            if 'gap' in res and res['gap'] is None:
+                note = "  no squad found in {} s".format(time_limit)
+            else:
+                note = "  gap {:.2%}".format(res['gap']) if res.get('gap', 0) > 0 else ""
+            print("{:24s} {:6d} players {:10.1f} ms {:10.1f} MB{}".format(
+                name, n_players, 1000 * res['seconds'], res['peak_mb'], note))
+            results.append(res)
+    meta = dict(commit=_git_commit(), python=platform.python_version(), platform=platform.platform(),
+                numpy=np.__version__, pandas=pd.__version__, scipy=scipy.__version__, seed=seed, time_limit=time_limit,
+                recorded=recorded, time=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    return dict(meta=meta, results=results)
+
+
+def compare(results, baseline, tolerance, min_seconds=0.005):
+    """
+    Results slower, or with a larger peak memory, than the same case and size of baseline by more than tolerance
+    (a fraction, 0.2 is 20%); differences under min_seconds are timer noise and never count
+    """
+    base = {(r['case'], r['players']): r for r in baseline['results']}
+    regressions = []
+    for r in results['results']:
+        b = base.get((r['case'], r['players']))
+        if b is None:
+            continue
+        slower = r['seconds'] > b['seconds'] * (1 + tolerance) and r['seconds'] - b['seconds'] > min_seconds
+        larger = r['peak_mb'] > b['peak_mb'] * (1 + tolerance) and r['peak_mb'] - b['peak_mb'] > 1
+        if slower or larger:
+            regressions.append(dict(case=r['case'], players=r['players'],
+                                    seconds=r['seconds'], baseline_seconds=b['seconds'],
+                                    peak_mb=r['peak_mb'], baseline_peak_mb=b['peak_mb']))
+    return regressions
+
+
+def main(sizes, cases, repeat, time_limit, out, baseline, tolerance, recorded=False):
+    results = run(sizes, cases, repeat, time_limit=time_limit, recorded=recorded)
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print("results written to {}".format(out))
+
+    if baseline is None:
+        return 0
+
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f), tolerance)
+    for r in regressions:
+        print("REGRESSION {case} with {players} players: {t:.1f} ms (baseline {bt:.1f} ms), {m:.1f} MB "
+              "(baseline {bm:.1f} MB)".format(case=r['case'], players=r['players'], t=1000 * r['seconds'],
+                                              bt=1000 * r['baseline_seconds'], m=r['peak_mb'],
+                                              bm=r['baseline_peak_mb']))
+    print("{} regressions against {} (tolerance {:.0%})".format(len(regressions), baseline, tolerance))
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES.values()), help="numbers of players")
+    parser.add_argument('--cases', nargs='+', default=[c for c in CASES if c not in SLOW_CASES], choices=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--time-limit', type=float, default=SOLVER_TIME_LIMIT, help="seconds per squad solve")
+    parser.add_argument('--out', default=None, help="json file for the results")
+    parser.add_argument('--baseline', default=None, help="json results to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown counted as a regression")
+    parser.add_argument('--recorded', action='store_true', help="use the recorded bootstrap data instead of --sizes")
+    args = parser.parse_args()
+
+    sys.exit(main(sizes=args.sizes, cases=args.cases, repeat=args.repeat, time_limit=args.time_limit, out=args.out,
+                  baseline=args.baseline, tolerance=args.tolerance, recorded=args.recorded))
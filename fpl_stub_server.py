@@ -0,0 +1,68 @@
+"""
+Local stand-in for the fantasy.premierleague.com API that serves payloads recorded with ROBOKLOPP_FPL_MODE=record
+
+    python fpl_stub_server.py --port 8765 --latency 0.2
+    ROBOKLOPP_FPL_MODE=replay ROBOKLOPP_REPLAY_URL=http://localhost:8765 streamlit run 0_🤖_Robo_Klopp_Main.py
+
+GET /api/bootstrap-static/ returns <path>/api/bootstrap-static.json, /api/my-team/<id>/ returns <path>/api/my-team/<id>.json, ...
+Paths with an extension, like the player photos recorded by photo_cache.py, are served as they are.
+
+    ROBOKLOPP_FPL_MODE=replay ROBOKLOPP_REPLAY_URL=http://localhost:8765 python photo_cache.py
+"""
+import argparse
+import mimetypes
+import os
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from get_data import RECORD_DIR
+
+
+class RecordedPayloadHandler(BaseHTTPRequestHandler):
+    def __init__(self, *args, path=RECORD_DIR, latency=0.0, **kwargs):
+        self.record_path = path
+        self.latency = latency
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        parts = [p for p in self.path.split('?')[0].split('/') if p not in ('', '.', '..')]
+        fn = os.path.join(self.record_path, *parts)
+        if len(parts) == 0 or not os.path.splitext(parts[-1])[1]:
+            fn += '.json'
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if len(parts) == 0 or not os.path.isfile(fn):
+            self.send_error(404, "No recording for {}".format(self.path))
+            return
+
+        with open(fn, 'rb') as f:
+            body = f.read()
+
+        self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(fn)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8765, path=RECORD_DIR, latency=0.0):
+    handler = partial(RecordedPayloadHandler, path=path, latency=latency)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    print("Serving {} on http://127.0.0.1:{}".format(path, port))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--path', default=RECORD_DIR, help="directory with the recorded payloads")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    args = parser.parse_args()
+
+    serve(port=args.port, path=args.path, latency=args.latency)
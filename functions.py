@@ -1,3 +1,10 @@
+import heapq
+import itertools
+
+import numpy as np
+import pandas as pd
+
+
 def eval_team(df_team, col_prefixes=None):
     res = dict(
         ep_this=df_team['ep_this'].fillna(0).astype(float).sum(),
@@ -19,31 +26,232 @@ def eval_team(df_team, col_prefixes=None):
     return res
 
 
+class SquadEvaluator:
+    """
+    eval_team for many squads at once
+    df: players; the columns eval_team reads, plus the ones starting with col_prefixes, are converted to one float
+        matrix when the evaluator is built
+    Squads are given as a matrix with the df index of their players (n_squads x players per squad)
+    """
+    SUM_COLUMNS = dict(ep_this='ep_this', ep_next='ep_next', cost='now_cost', points='total_points')
+    MEAN_COLUMNS = dict(avg_select_percent='selected_by_percent', avg_form='form')
+
+    def __init__(self, df, col_prefixes=None):
+        prefixed = []
+        for prefix in col_prefixes or []:
+            prefixed += [col for col in df.columns if col.startswith(prefix)]
+
+        self.index = df.index
+        self.metrics = list(self.SUM_COLUMNS) + list(self.MEAN_COLUMNS) + ['avg_' + col for col in prefixed]
+        self.is_mean = np.array([m not in self.SUM_COLUMNS for m in self.metrics])
+
+        columns = list(self.SUM_COLUMNS.values()) + list(self.MEAN_COLUMNS.values()) + prefixed
+        self.values = df[columns].to_numpy(dtype=float, copy=True)
+        self.values[:, :2] = np.nan_to_num(self.values[:, :2])  # ep_this and ep_next are filled with 0
+
+    def rows(self, squads):
+        """ Row positions of the players in squads (a matrix of df index values) """
+        squads = np.asarray(squads)
+        return self.index.get_indexer(squads.ravel()).reshape(squads.shape)
+
+    def evaluate(self, squads):
+        """ Metrics (n_squads x len(self.metrics)) of every squad, skipping missing values as pandas does """
+        v = self.values[self.rows(squads)]
+        sums = np.nansum(v, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.is_mean, sums / (~np.isnan(v)).sum(axis=1), sums)
+
+    def evaluate_swaps(self, squad, players_out, players_in):
+        """
+        Metrics of squad (index values of its players) after replacing each row of players_out with the same row of
+        players_in (n x k matrices of index values), updating the sums and counts of squad instead of building the
+        new squads
+        """
+        base = self.values[self.rows(squad)]
+        v_out = self.values[self.rows(players_out)]
+        v_in = self.values[self.rows(players_in)]
+        sums = np.nansum(base, axis=0) - np.nansum(v_out, axis=1) + np.nansum(v_in, axis=1)
+        counts = (~np.isnan(base)).sum(axis=0) - (~np.isnan(v_out)).sum(axis=1) + (~np.isnan(v_in)).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.is_mean, sums / counts, sums)
+
+    def frame(self, squads):
+        """ Same as evaluate, as a DataFrame with the eval_team keys as columns """
+        return pd.DataFrame(self.evaluate(squads), columns=self.metrics)
+
+
+class _TransferArrays:
+    """ Numpy views of the players used by the transfer searches, with the squad as row positions """
+
+    def __init__(self, df, squad, teams, weights):
+        # squad players filtered out of df (e.g. an excluded team) can still leave, they are added back from squad
+        missing = squad.index[~squad.index.isin(df.index)]
+        if len(missing) > 0:
+            absent = [col for col in df.columns if col not in squad.columns]
+            if absent:
+                raise ValueError("Squad players {} are not in df and squad has no {} columns".format(
+                    list(missing), absent))
+            df = pd.concat([df, squad.loc[missing, df.columns]])
+        self.df = df
+        self.in_df = np.arange(len(df)) < len(df) - len(missing)  # players that can come in
+        self.squad_rows = df.index.get_indexer(squad.index)
+        self.in_squad = np.zeros(len(df), dtype=bool)
+        self.in_squad[self.squad_rows] = True
+        self.w = df[weights].to_numpy(float)
+        self.cost = df.now_cost.to_numpy(float)
+        self.element_type = df.element_type.to_numpy()
+        self.team_index, team_values = pd.factorize(df.team)
+        self.team_slots = np.array([teams.get(t, 0) for t in team_values])
+        self.names = (df.first_name + ' ' + df.second_name).to_numpy()
+
+    def free_slots(self, out_rows):
+        """ Players that can still be picked from every team once out_rows have left """
+        slots = self.team_slots.copy()
+        np.add.at(slots, self.team_index[out_rows], 1)
+        return slots
+
+
+def _transfer_results(arrays, out_rows, in_rows, col_prefixes):
+    # one row per transfer set: names, gain in weights and the eval_team metrics of the new squad
+    df = arrays.df
+    evaluator = SquadEvaluator(df, col_prefixes=col_prefixes)
+    metrics = evaluator.evaluate_swaps(df.index[arrays.squad_rows], df.index.to_numpy()[out_rows],
+                                       df.index.to_numpy()[in_rows])
+    res = pd.DataFrame(dict(player_out=[' / '.join(arrays.names[r]) for r in out_rows],
+                            player_in=[' / '.join(arrays.names[r]) for r in in_rows],
+                            elements_out=[tuple(df.index[r]) for r in out_rows],
+                            elements_in=[tuple(df.index[r]) for r in in_rows],
+                            gain=arrays.w[in_rows].sum(axis=1) - arrays.w[out_rows].sum(axis=1)))
+    return pd.concat([res, pd.DataFrame(metrics, columns=evaluator.metrics)], axis=1)
+
+
+def single_transfers(df, squad, teams, top_n=50, extra_budget=0, weights='weights',
+                     col_prefixes=('weights', 'transfers_')):
+    """
+    For every player of squad at once, the top_n players by weights that can replace him: same position, within his
+    cost plus extra_budget and from a team with a free slot once he left (keeping him is one of the options)
+    teams: dict with {team: number of players we can still select from it}
+    Returns a DataFrame with player_out, player_in, the gain in weights and the eval_team metrics of the new squad
+    """
+    a = _TransferArrays(df, squad, teams, weights)
+    out = a.squad_rows[:, None]
+    team_in = a.team_index[None, :]
+    eligible = ((a.element_type[None, :] == a.element_type[out]) &
+                (a.cost[None, :] <= extra_budget + a.cost[out]) &
+                (a.team_slots[team_in] + (team_in == a.team_index[out]) > 0) &
+                a.in_df[None, :] & (~a.in_squad[None, :] | (np.arange(len(a.df))[None, :] == out)))
+
+    scores = np.where(eligible, a.w[None, :], -np.inf)
+    best = np.argsort(-scores, axis=1, kind='stable')[:, :top_n]
+    keep = np.isfinite(np.take_along_axis(scores, best, axis=1))
+    out_rows = np.broadcast_to(out, best.shape)[keep][:, None]
+    in_rows = best[keep][:, None]
+    return _transfer_results(a, out_rows, in_rows, list(col_prefixes))
+
+
 def squad_transfer(df, squad, teams, top_n=50, extra_budget=0):
+    """
+    single_transfers as a list of (new squad, eval_team of the new squad with player_out and player_in)
+    """
+    res = single_transfers(df, squad, teams, top_n=top_n, extra_budget=extra_budget)
     new_squads = []
-    for id_rp, removed_player in squad.iterrows():
-        _sq = squad.drop(id_rp)
-        budget = extra_budget + removed_player['now_cost']
-        print(budget)
-        teams[removed_player['team']] += 1
-        teams_to_pick = [k for k, v in teams.items() if v > 0]
-        print(teams_to_pick)
-
-        # remove current squad (leave the transfer player as one option is to leave him there)
-        _df = df[~df.index.isin(_sq.index)]
-        _df = _df[_df['now_cost'] <= budget]  # below budget
-        _df = _df[_df['team'].isin(teams_to_pick)]  # ok team
-        _df = _df[_df['element_type'] == removed_player['element_type']]  # same position
-
-        for _, _np in _df.sort_values('weights', ascending=False).head(top_n).iterrows():
-            _ns = _sq.append(_np)
-
-            d_in_out_eval = dict(
-                player_out=' '.join(removed_player[['first_name', 'second_name']]),
-                player_in=' '.join(_np[['first_name', 'second_name']])
-            )
-
-            d_in_out_eval.update(eval_team(_ns, col_prefixes=['weights', 'transfers_']))
-            new_squads.append((_ns, d_in_out_eval))
-
+    for r in res.itertuples(index=False):
+        _ns = pd.concat([squad.drop(list(r.elements_out)), df.loc[list(r.elements_in)]])
+        d_in_out_eval = r._asdict()
+        for k in ['elements_out', 'elements_in', 'gain']:
+            del d_in_out_eval[k]
+        new_squads.append((_ns, d_in_out_eval))
     return new_squads
+
+
+def multi_transfers(df, squad, teams, n_transfers=2, top_n=50, extra_budget=0, weights='weights',
+                    col_prefixes=('weights', 'transfers_')):
+    """
+    The top_n sets of n_transfers transfers by the gain in weights of the squad, by branch and bound
+    Outgoing sets and incoming players are tried from the highest bound down, the bound of the positions still to
+    fill being the best weight each one can afford (once the cheapest players of the others are paid for, ignoring
+    teams). Every level only keeps the players that fit the budget and a team slot and whose weight can still beat
+    the top_n-th gain found so far, and a branch is cut as soon as its bound cannot
+    teams: dict with {team: number of players we can still select from it}
+    Returns a DataFrame like single_transfers, best first
+    """
+    a = _TransferArrays(df, squad, teams, weights)
+    candidates, best_w, frontier, min_cost = {}, {}, {}, {}
+    for p in np.unique(a.element_type[a.squad_rows]):
+        rows = np.flatnonzero((a.element_type == p) & ~a.in_squad)
+        candidates[p] = rows[np.argsort(-a.w[rows], kind='stable')]
+        best_w[p] = a.w[candidates[p]]
+        # (cost, weight) Pareto frontier: the players by cost with the best weight up to each cost
+        by_cost = rows[np.argsort(a.cost[rows], kind='stable')]
+        frontier[p] = a.cost[by_cost], np.maximum.accumulate(a.w[by_cost])
+        min_cost[p] = a.cost[by_cost[0]] if len(rows) > 0 else np.inf
+
+    def bound(positions, budget):
+        # best total weight players of the given positions can add within budget (a number or an array)
+        budget = np.asarray(budget, dtype=float)
+        costs = np.array([min_cost[p] for p in positions])
+        if not np.isfinite(costs).all():
+            return np.full(budget.shape, -np.inf)
+        total = np.zeros(budget.shape)
+        for p, cost in zip(positions, costs):
+            frontier_cost, frontier_w = frontier[p]
+            k = np.searchsorted(frontier_cost, budget - (costs.sum() - cost), side='right') - 1
+            total += np.where(k >= 0, frontier_w[np.maximum(k, 0)], -np.inf)
+        return total
+
+    out_sets = np.array(list(itertools.combinations(a.squad_rows, n_transfers)))
+    out_positions = np.sort(a.element_type[out_sets], axis=1)
+    out_budgets = extra_budget + a.cost[out_sets].sum(axis=1)
+    out_bounds = np.array([bound(p, b) for p, b in zip(out_positions, out_budgets)]) - a.w[out_sets].sum(axis=1)
+
+    top = []  # min heap of (gain, out_rows, in_rows), at most top_n long
+
+    def threshold():
+        return top[0][0] if len(top) == top_n else -np.inf
+
+    def search(out_rows, positions, i, start, gain, budget, slots, chosen):
+        p, rest = positions[i], positions[i + 1:]
+        rest_bound = float(bound(rest, budget - min_cost[p])) if len(rest) > 0 else 0.
+        if rest_bound == -np.inf:
+            return
+        # the candidates are by weight, the ones from last on cannot beat the threshold whatever they cost
+        first = start if i > 0 and p == positions[i - 1] else 0
+        last = np.searchsorted(-best_w[p], gain + rest_bound - threshold(), side='left')
+        index = np.arange(first, max(first, last))
+        rows = candidates[p][index]
+        fits = (a.cost[rows] + sum(min_cost[q] for q in rest) <= budget) & (slots[a.team_index[rows]] > 0)
+        index, rows = index[fits], rows[fits]
+
+        if len(rest) == 0:
+            # the last player: the gains are in the order of the candidates
+            for r in rows[:top_n]:
+                if gain + a.w[r] <= threshold():
+                    break
+                item = (gain + a.w[r], tuple(out_rows), tuple(chosen + [r]))
+                if len(top) < top_n:
+                    heapq.heappush(top, item)
+                else:
+                    heapq.heappushpop(top, item)
+            return
+
+        upper = gain + a.w[rows] + bound(rest, budget - a.cost[rows])
+        order = np.argsort(-upper, kind='stable')
+        for j, r, u in zip(index[order], rows[order], upper[order]):
+            if u <= threshold():
+                break  # the rest of the candidates have lower bounds
+            slots[a.team_index[r]] -= 1
+            chosen.append(r)
+            search(out_rows, positions, i + 1, j + 1, gain + a.w[r], budget - a.cost[r], slots, chosen)
+            chosen.pop()
+            slots[a.team_index[r]] += 1
+
+    for k in np.argsort(-out_bounds, kind='stable'):
+        if out_bounds[k] <= threshold():
+            break
+        out_rows = out_sets[k]
+        search(out_rows, out_positions[k], 0, 0, -a.w[out_rows].sum(), out_budgets[k], a.free_slots(out_rows), [])
+
+    top = sorted(top, reverse=True)
+    out_rows = np.array([t[1] for t in top], dtype=int).reshape(-1, n_transfers)
+    in_rows = np.array([t[2] for t in top], dtype=int).reshape(-1, n_transfers)
+    return _transfer_results(a, out_rows, in_rows, list(col_prefixes))
@@ -1,9 +1,265 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+import requests
+
+from perf import span
+from player_table import PlayerTable
+
 FILL_NA_CHANCE_OF_PLAYING = 100
+# numbers the API sends as strings, or with missing values
+FLOAT_COLUMNS = ['now_cost', 'ep_this', 'ep_next', 'form', 'selected_by_percent', 'points_per_game']
+SNAPSHOT_FORMAT = 2  # part of the snapshot key, bump it when _build_snapshot changes
+
+CACHE_DIR = os.environ.get('ROBOKLOPP_CACHE_DIR', os.path.join('.cache', 'roboklopp'))
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, 'snapshots')
+SNAPSHOT_TTL = int(os.environ.get('ROBOKLOPP_SNAPSHOT_TTL', 15 * 60))  # seconds before a background refresh
+SNAPSHOT_LRU_SIZE = 4
+
+FPL_MODE = os.environ.get('ROBOKLOPP_FPL_MODE', 'live')  # live, record or replay
+RECORD_DIR = os.environ.get('ROBOKLOPP_RECORD_DIR', os.path.join(CACHE_DIR, 'recordings'))
+REPLAY_URL = os.environ.get('ROBOKLOPP_REPLAY_URL')  # e.g. http://localhost:8765 to replay through fpl_stub_server.py
+
+
+class SnapshotCache:
+    """
+    Two tier cache for the results of get_data, keyed by (game_week, content_hash)
+    memory: small LRU shared by every page and session of the streamlit process
+    disk: one pickle per snapshot under path, so a restart does not need a new download
+    ttl: seconds a snapshot is fresh, after that it is still served while get_data fetches a new one
+    Safe to use from the session threads and the background refresh at the same time
+    """
+
+    def __init__(self, path=SNAPSHOT_DIR, ttl=SNAPSHOT_TTL, max_size=SNAPSHOT_LRU_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lru = OrderedDict()
+        self._latest = None  # (key, fetched_at) of the last snapshot fetched
+        self._lock = threading.RLock()
+
+    def latest_entry(self):
+        """ (key, fetched_at) of the last fetched snapshot at any age, None when there is none """
+        with self._lock:
+            if self._latest is None:
+                self._latest = self._latest_on_disk()
+            return self._latest
+
+    def get(self, key):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+
+            snapshot = self._read(key)
+            if snapshot is not None:
+                self._remember(key, snapshot)
+            return snapshot
+
+    def put(self, key, snapshot):
+        with self._lock:
+            self._remember(key, snapshot)
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = self._file(key) + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self._file(key))
+            self._latest = (key, time.time())
+
+    def touch(self, key):
+        """ Marks an already cached snapshot as freshly fetched (content did not change upstream) """
+        with self._lock:
+            if os.path.exists(self._file(key)):
+                os.utime(self._file(key))
+            self._latest = (key, time.time())
+
+    def invalidate(self, game_week=None):
+        """ Drops all snapshots, or only the ones of game_week, from memory and disk """
+        with self._lock:
+            for key in [k for k in self._lru if game_week is None or k[0] == game_week]:
+                del self._lru[key]
+            for key in [k for k in self._keys_on_disk() if game_week is None or k[0] == game_week]:
+                os.remove(self._file(key))
+            if self._latest is not None and (game_week is None or self._latest[0][0] == game_week):
+                self._latest = None
+
+    def _remember(self, key, snapshot):
+        self._lru[key] = snapshot
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _file(self, key):
+        return os.path.join(self.path, "gw{}-{}.pkl".format(*key))
+
+    def _read(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _keys_on_disk(self):
+        if not os.path.isdir(self.path):
+            return []
+        keys = []
+        for fn in os.listdir(self.path):
+            if fn.startswith('gw') and fn.endswith('.pkl'):
+                game_week, content_hash = fn[2:-4].split('-', 1)
+                keys.append((int(game_week), content_hash))
+        return keys
+
+    def _latest_on_disk(self):
+        keys = self._keys_on_disk()
+        if len(keys) == 0:
+            return None
+        key = max(keys, key=lambda k: os.path.getmtime(self._file(k)))
+        return key, os.path.getmtime(self._file(key))
+
+
+_snapshots = SnapshotCache()
+_player_tables = OrderedDict()  # snapshot key -> PlayerTable, as small as the snapshot LRU
+_player_tables_lock = threading.Lock()
+_fetch_lock = threading.Lock()  # held while fetch_info runs, so only one fetch is in flight per process
+_refreshing = threading.Lock()  # held by the background refresh
+
+
+def _to_payload(v):
+    # dataframes are stored as the list of records they were built from
+    if isinstance(v, pd.DataFrame):
+        return json.loads(v.to_json(orient='records', date_format='iso'))
+    if isinstance(v, dict):
+        return {k: _to_payload(_v) for k, _v in v.items()}
+    return v
+
+
+def _from_payload(payload):
+    # same conversion as FPLData(convert_to_dataframes=True): top level lists become dataframes
+    if isinstance(payload, list):
+        return pd.DataFrame(payload)
+    return {k: pd.DataFrame(v) if isinstance(v, list) else v for k, v in payload.items()}
+
+
+class RecordReplayFPL:
+    """
+    Wraps an FPLData object so its API calls can be recorded to disk and replayed without the network
+    mode: live (pass through), record (call the API and store the payloads) or replay (only use stored payloads)
+    path: directory with the payloads, laid out like the API urls (api/bootstrap-static.json, api/my-team/<id>.json, ...)
+    url: when replaying, fetch the payloads from this server (see fpl_stub_server.py) instead of reading path
+    """
+
+    def __init__(self, fpl, mode=FPL_MODE, path=RECORD_DIR, url=REPLAY_URL):
+        assert mode in ('live', 'record', 'replay'), "Unknown mode {}".format(mode)
+        self.fpl = fpl
+        self.mode = mode
+        self.path = path
+        self.url = url
+
+    def fetch_info(self):
+        return self._call('api/bootstrap-static', lambda: self.fpl.fetch_info())
+
+    def fetch_my_team(self, my_team, **kwargs):
+        return self._call('api/my-team/{}'.format(my_team), lambda: self.fpl.fetch_my_team(my_team=my_team, **kwargs))
+
+    def fetch_managers(self, managers):
+        if self.mode == 'live':
+            return self.fpl.fetch_managers(managers)
+
+        # FPLData gives a dataframe per manager, not the api/entry/<id> payload (see batch_recommend.PublicFPL), so
+        # it is stored next to it
+        if self.mode == 'record':
+            res = self.fpl.fetch_managers(managers)
+            for m in managers:
+                self._store('api/entry/{}/summary'.format(m), res[m])
+            return res
+
+        return {m: _from_payload(self._load('api/entry/{}/summary'.format(m))) for m in managers}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        # transfers and team picks change the real team, so they are never sent while replaying
+        if self.mode == 'replay':
+            raise RuntimeError("FPLData.{} is not available in replay mode".format(name))
+        return getattr(self.fpl, name)
+
+    def _call(self, endpoint, fetch):
+        if self.mode == 'live':
+            return fetch()
 
-def get_data(fpl):
-    df_info = fpl.fetch_info()
+        if self.mode == 'record':
+            res = fetch()
+            self._store(endpoint, res)
+            return res
 
-    game_week = df_info["events"][df_info["events"].is_next].id.iloc[0]
+        return _from_payload(self._load(endpoint))
+
+    def _file(self, endpoint):
+        return os.path.join(self.path, *endpoint.split('/')) + '.json'
+
+    def _store(self, endpoint, res):
+        os.makedirs(os.path.dirname(self._file(endpoint)), exist_ok=True)
+        with open(self._file(endpoint), 'w') as f:
+            json.dump(_to_payload(res), f)
+
+    def _load(self, endpoint):
+        if self.url is not None:
+            r = requests.get("{}/{}/".format(self.url.rstrip('/'), endpoint))
+            r.raise_for_status()
+            return r.json()
+
+        with open(self._file(endpoint)) as f:
+            return json.load(f)
+
+
+def wrap_fpl(fpl, mode=FPL_MODE):
+    """ Applies the record/replay layer selected with ROBOKLOPP_FPL_MODE to an FPLData object """
+    if mode == 'live':
+        return fpl
+    return RecordReplayFPL(fpl, mode=mode)
+
+
+def invalidate_snapshots(game_week=None):
+    """ Forces the next get_data call to fetch the bootstrap data again """
+    _snapshots.invalidate(game_week=game_week)
+    with _player_tables_lock:
+        for key in [k for k in _player_tables if game_week is None or k[0] == game_week]:
+            del _player_tables[key]
+
+
+def _content_hash(df_info):
+    h = hashlib.sha1()
+    h.update(repr(SNAPSHOT_FORMAT).encode())
+    for k in sorted(df_info):
+        v = df_info[k]
+        h.update(k.encode())
+        if hasattr(v, 'to_json'):
+            h.update(v.to_json(orient='split', default_handler=str).encode())
+        else:
+            h.update(repr(v).encode())
+    return h.hexdigest()[:16]
+
+
+def _next_game_week(df_info):
+    return int(df_info["events"][df_info["events"].is_next].id.iloc[0])
+
+
+def _copy_snapshot(snapshot):
+    # pages add columns and cast types on what they get, so the cached frames are never handed out
+    df_info, game_week, df_elements, df_teams, df_type = snapshot
+    df_info = {k: v.copy() if hasattr(v, 'copy') else v for k, v in df_info.items()}
+    return df_info, game_week, df_elements.copy(), df_teams.copy(), df_type.copy()
+
+
+def _build_snapshot(df_info):
+    game_week = _next_game_week(df_info)
     df_elements = df_info['elements'].set_index('id')
     df_teams = df_info['teams'].set_index('id')
     df_type = df_info['element_types'].set_index('id')
@@ -20,6 +276,106 @@ def get_data(fpl):
 
     df_elements.chance_of_playing_next_round = df_elements.chance_of_playing_next_round.fillna(
         FILL_NA_CHANCE_OF_PLAYING)
+    for col in FLOAT_COLUMNS:
+        if col in df_elements:
+            df_elements[col] = df_elements[col].astype(float)
     df_elements["full_name"] = df_elements.first_name + ' ' + df_elements.second_name
 
     return df_info, game_week, df_elements, df_teams, df_type
+
+
+def _fetch(fpl, since):
+    """
+    Fetches the bootstrap data and caches its snapshot, one call at a time (single flight): callers that waited for
+    the lock while another thread fetched use that snapshot, when it was fetched after since (time.time() of the call)
+    """
+    with _fetch_lock:
+        entry = _snapshots.latest_entry()
+        if entry is not None and entry[1] >= since:
+            snapshot = _snapshots.get(entry[0])
+            if snapshot is not None:
+                return entry[0], snapshot
+
+        with span('fetch_info'):
+            df_info = fpl.fetch_info()
+        key = (_next_game_week(df_info), _content_hash(df_info))
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            with span('build_snapshot'):
+                snapshot = _build_snapshot(df_info)
+            _snapshots.put(key, snapshot)
+        else:
+            _snapshots.touch(key)
+        return key, snapshot
+
+
+def _refresh_in_background(fpl):
+    # at most one background refresh at a time, the calls made meanwhile keep the stale snapshot
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            _fetch(fpl, time.time())
+        except Exception:  # the stale snapshot is served until a later call refreshes it
+            logging.warning("Refreshing the FPL data failed", exc_info=True)
+        finally:
+            _refreshing.release()
+
+    threading.Thread(target=run, name='snapshot-refresh', daemon=True).start()
+
+
+def _snapshot(fpl, refresh):
+    entry = None if refresh else _snapshots.latest_entry()
+    snapshot = None if entry is None else _snapshots.get(entry[0])
+    if snapshot is None:
+        return _fetch(fpl, time.time())
+
+    key, fetched_at = entry
+    if time.time() - fetched_at > _snapshots.ttl:
+        _refresh_in_background(fpl)
+    return key, snapshot
+
+
+def get_data(fpl, refresh=False):
+    """
+    Returns (df_info, game_week, df_elements, df_teams, df_type) for the next game week
+    Snapshots are shared by every session of the process. Only the first call (or refresh=True) waits for
+    fpl.fetch_info(), and concurrent calls wait for the same fetch. Once a snapshot is older than SNAPSHOT_TTL it is
+    still returned at once while a background thread fetches the new one (stale while revalidate)
+    """
+    with span('get_data'):
+        _, snapshot = _snapshot(fpl, refresh)
+        with span('copy'):
+            return _copy_snapshot(snapshot)
+
+
+def _player_table(key, snapshot):
+    with _player_tables_lock:
+        if key not in _player_tables:
+            with span('player_table'):
+                _player_tables[key] = PlayerTable.from_elements(snapshot[2], version=key)
+            while len(_player_tables) > SNAPSHOT_LRU_SIZE:
+                _player_tables.popitem(last=False)
+        _player_tables.move_to_end(key)
+        return _player_tables[key]
+
+
+def get_player_table(fpl, refresh=False):
+    """
+    Returns the PlayerTable of the same snapshot get_data serves, built once per snapshot and shared by every page
+    and session of the process; unlike get_data nothing is copied, so the table and its frame() are read only
+    """
+    return _player_table(*_snapshot(fpl, refresh))
+
+
+def get_data_and_table(fpl, refresh=False):
+    """
+    Returns (get_data(fpl), get_player_table(fpl)) from the same snapshot, so a background refresh landing between
+    the two calls cannot give the solvers players the displayed frames do not have
+    """
+    with span('get_data'):
+        key, snapshot = _snapshot(fpl, refresh)
+        with span('copy'):
+            data = _copy_snapshot(snapshot)
+    return data, _player_table(key, snapshot)
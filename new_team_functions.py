@@ -1,107 +1,200 @@
+import numpy as np
 import pandas as pd
-import random
 from new_team_config import MAP_POS_NUM, MAP_NUM_POS
-import itertools
-from functions import eval_team
+import heapq
+from functions import SquadEvaluator
 
 
-def pick(df: pd.DataFrame, weights: str, cost: str, budget: int, positions: dict, team_budget: dict):
+def _draw_picks(log_w, element_type, team_index, costs, budget, positions_left, team_left, n_picks, n_draws, rng):
     """
-    Picks players from a dataframe using the weights and under a cost envelope
+    n_draws sequential draws at once: at every step each draw takes the eligible player with the largest
+    log_w + Gumbel noise, which picks it with probability proportional to its weight (Gumbel-max trick)
+    The players eligible for a draw only ever shrink (budget, positions and teams only go down), so the same keys
+    are reused for every step, as in Gumbel top-k sampling without replacement
+    Returns the chosen row positions (n_alive x n_picks) of the draws that never ran out of eligible players
+    """
+    n_players = len(log_w)
+    rows = np.arange(n_draws)
+    budget_left = np.full(n_draws, float(budget))
+    positions_left = np.tile(positions_left, (n_draws, 1))
+    team_left = np.tile(team_left, (n_draws, 1))
+    available = np.ones((n_draws, n_players), dtype=bool)
+    alive = np.ones(n_draws, dtype=bool)
+    chosen = np.empty((n_draws, n_picks), dtype=int)
+    keys = log_w + rng.gumbel(size=(n_draws, n_players))
+
+    for step in range(n_picks):
+        eligible = (available & (positions_left[:, element_type] > 0) & (team_left[:, team_index] > 0) &
+                    (costs <= budget_left[:, None]))
+        step_keys = np.where(eligible, keys, -np.inf)
+        player = step_keys.argmax(axis=1)
+        alive &= np.isfinite(step_keys[rows, player])
+
+        chosen[:, step] = player
+        available[rows, player] = False
+        positions_left[rows, element_type[player]] -= 1
+        team_left[rows, team_index[player]] -= 1
+        budget_left -= costs[player]
+
+    return chosen[alive]
+
+
+def sample_pick_index(df: pd.DataFrame, weights: str, cost: str, budget: int, positions: dict, team_budget: dict,
+                      n_draws: int = 1, rng=None, max_rounds: int = 20):
+    """
+    Draws n_draws independent picks of players at once, each one as pick() does: players are drawn one at a time
+    with probability proportional to weights, among the ones that still fit positions, team_budget and budget
+    Draws that run out of players before the end are thrown away and drawn again, for at most max_rounds rounds
     df: DataFrame
     weights: weight column name
     cost: cost column name
     budget: total budget to use
     positions: dict with {position: number of players to pick}
     team_budget: dict with {teams: number of players we can still select from teams}
-  """
-    df.copy()
-    positions = positions.copy()
-    team_budget = team_budget.copy()
-
+    rng: numpy Generator, a new one by default
+    Returns the df index of the players of every successful draw (n x players), fewer than n_draws rows if the
+    rounds ran out
+    """
+    rng = np.random.default_rng() if rng is None else rng
     n_picks = sum(positions.values())
     teams_left = {code for code, val in team_budget.items() if val > 0}
     positions_left = {MAP_POS_NUM[pos] for pos, val in positions.items() if val > 0}
 
-    # filter by position left to pick
-    df = df[df.element_type.isin(positions_left)]
-
-    # filter out teams we exhausted the pick
-    df = df[df.team_code.isin(teams_left)]
-
-    # filter out players with higher cost
-    df = df[df.now_cost <= budget]
+    # players that can never be picked are dropped once, instead of on every step
+    df = df[df.element_type.isin(positions_left) & df.team_code.isin(teams_left) & (df[cost] <= budget)]
+    if len(df) == 0 or n_picks == 0:
+        return np.empty((0, n_picks), dtype=df.index.dtype)
+
+    team_index, teams = pd.factorize(df.team_code)
+    with np.errstate(divide='ignore'):
+        log_w = np.log(df[weights].to_numpy(float))
+    args = dict(log_w=log_w,
+                element_type=df.element_type.to_numpy() - 1,
+                team_index=team_index,
+                costs=df[cost].to_numpy(float),
+                budget=budget,
+                positions_left=np.array([positions.get(MAP_NUM_POS[t], 0) for t in range(1, 5)]),
+                team_left=np.array([team_budget[t] for t in teams]),
+                n_picks=n_picks)
+
+    chosen = [np.empty((0, n_picks), dtype=int)]
+    n_chosen = 0
+    for _ in range(max_rounds):
+        if n_chosen >= n_draws:
+            break
+        chosen.append(_draw_picks(n_draws=n_draws - n_chosen, rng=rng, **args))
+        n_chosen += len(chosen[-1])
+
+    return df.index.to_numpy()[np.concatenate(chosen)[:n_draws]]
+
+
+def sample_picks(df: pd.DataFrame, weights: str, cost: str, budget: int, positions: dict, team_budget: dict,
+                 n_draws: int = 1, rng=None, max_rounds: int = 20):
+    """ Same as sample_pick_index, with a DataFrame per successful draw """
+    return [df.loc[ix] for ix in sample_pick_index(df=df, weights=weights, cost=cost, budget=budget,
+                                                   positions=positions, team_budget=team_budget, n_draws=n_draws,
+                                                   rng=rng, max_rounds=max_rounds)]
 
-    if len(df) == 0:
-        return None
 
-    player = df.sample(n=1, weights=weights)
-    df = df.drop(player.index, axis=0)
-    positions[MAP_NUM_POS[int(player.element_type)]] -= 1
-    team_budget[int(player.team_code)] -= 1
-    budget -= int(player.now_cost)
-
-    n_picks -= 1
-
-    if n_picks == 0:
-        return pd.DataFrame(player)
-    elif n_picks > 0:
-        sel = None
-        for i in range(20):  # try 20X at most
-            sel = pick(df=df, weights=weights, cost=cost, budget=budget, positions=positions, team_budget=team_budget)
-            if sel is not None:
-                break
-
-        if sel is None:
-            return None  # pd.DataFrame(player)
-        else:
-            return pd.concat([pd.DataFrame(player), sel])
+def pick(df: pd.DataFrame, weights: str, cost: str, budget: int, positions: dict, team_budget: dict):
+    """
+    Picks players from a dataframe using the weights and under a cost envelope
+    df: DataFrame
+    weights: weight column name
+    cost: cost column name
+    budget: total budget to use
+    positions: dict with {position: number of players to pick}
+    team_budget: dict with {teams: number of players we can still select from teams}
+    Returns None when no pick was found, see sample_picks to draw many at once
+  """
+    picks = sample_picks(df=df, weights=weights, cost=cost, budget=budget, positions=positions,
+                         team_budget=team_budget)
+    return picks[0] if len(picks) > 0 else None
 
 
-def get_squad_prod(df, pick_group_order, pick_groups_config, team_budget, extra_budget=0, top_n=5, ndraws_per_group=10):
+def get_squad_prod(df, pick_group_order, pick_groups_config, team_budget, extra_budget=0, top_n=5, ndraws_per_group=10,
+                   rng=None):
+    """
+    The top_n of ndraws_per_group picks of every pick group, in pick_group_order ({group: list of DataFrames}); the
+    budget the best pick of a group leaves is added to the budget of the next group
+    Raises ValueError when no pick of a group fits its budget, positions and team_budget
+    """
     df = df.copy()
     groups_picked = {}
-
-    # todo: this needs changing so it picks groups for one squad that doesnt have the same player twice
+    rng = np.random.default_rng() if rng is None else rng
 
     for pick_group in pick_group_order:
 
-        selections = []
-
         group_budget = pick_groups_config[pick_group]['budget']
-        for i in range(ndraws_per_group):
-
-            sel_ = pick(df=df,
-                        weights='w_' + pick_group,
-                        cost="now_cost",
-                        budget=group_budget + extra_budget,
-                        positions=pick_groups_config[pick_group]['players'],
-                        team_budget=team_budget)
+        selections = sample_pick_index(df=df,
+                                       weights='w_' + pick_group,
+                                       cost="now_cost",
+                                       budget=group_budget + extra_budget,
+                                       positions=pick_groups_config[pick_group]['players'],
+                                       team_budget=team_budget,
+                                       n_draws=ndraws_per_group,
+                                       rng=rng)
+        if len(selections) == 0:
+            raise ValueError("No pick of {} fits a budget of {} and the team budget".format(
+                pick_group, group_budget + extra_budget))
+
+        # best mean weight first, then the most budget left; only the top_n become DataFrames
+        values = df.loc[selections.ravel(), ['w_' + pick_group, 'now_cost']].to_numpy(float)
+        values = values.reshape(*selections.shape, 2)
+        mean_w = values[..., 0].mean(axis=1)
+        budget_left = group_budget - values[..., 1].sum(axis=1)
+        order = np.lexsort((rng.random(len(selections)), budget_left, 1 - mean_w))[:top_n]
+
+        extra_budget = budget_left[order[0]]
+        select_top_n = [df.loc[selections[i]] for i in order]
+        groups_picked[pick_group] = select_top_n
 
-            if sel_ is not None:
-                selections.append(sel_)
+        # players kept for this group are not available to the next ones, so any combination of the groups
+        # (see combine_and_pick_top) never has the same player twice
+        df = df.drop(pd.concat(select_top_n).index.unique())
 
-        selections = sorted(
-            [(1 - sel['w_' + pick_group].mean(), group_budget - sel.now_cost.sum(), random.random(), sel) for sel
-             in selections])
+    return groups_picked
 
-        extra_budget = selections[0][1]
-        select_top_n = [_s[3] for _s in selections[:top_n]]
 
-        print('{}: All extra budgets:'.format(pick_group), [_s[1] for _s in selections[:top_n]])
-
-        groups_picked[pick_group] = select_top_n
-
-        # full_squad = pd.concat([full_squad, select_top])
-        # full_squad = select_top if full_squad is None else pd.concat([full_squad, select_top])
-    return groups_picked
+def _group_keys(candidates, by_order):
+    # metrics of a squad are sums of the metrics of its groups; avg_ metrics are means over a fixed number of
+    # players, so their group sums order the combinations the same way
+    players = pd.concat(candidates)
+    evaluator = SquadEvaluator(players[~players.index.duplicated()])
+    metrics = evaluator.frame(np.array([sq.index for sq in candidates]))
+    metrics.loc[:, metrics.columns.str.startswith('avg_')] *= len(candidates[0])
+    return list(metrics[by_order].itertuples(index=False, name=None))
 
 
 def combine_and_pick_top(comb_squad, by_order, top_n=10):
-    prod_groups = list(itertools.product(*comb_squad.values()))
-    prod_squads = [pd.concat(pg) for pg in prod_groups]
-    eval_squads = pd.DataFrame([eval_team(sq) for sq in prod_squads])
-    top_squad_indices = eval_squads.sort_values(by=by_order, ascending=False).head(top_n).index
-
-    top_squads = [prod_squads[ind_] for ind_ in top_squad_indices]
-    return top_squads
+    """
+    The top_n squads, by the eval_team metrics in by_order (descending), among all the combinations of one
+    candidate per group of comb_squad ({group: list of DataFrames})
+    Candidates are sorted per group and combinations come best first out of a heap that only grows by the
+    neighbours of the ones popped, so just the top_n squads are ever concatenated
+    """
+    by_order = [by_order] if isinstance(by_order, str) else list(by_order)
+    groups = []
+    for candidates in comb_squad.values():
+        keys = _group_keys(candidates, by_order)
+        order = sorted(range(len(candidates)), key=lambda i: keys[i], reverse=True)
+        groups.append(([candidates[i] for i in order], [keys[i] for i in order]))
+    if len(groups) == 0 or any(len(candidates) == 0 for candidates, _ in groups):
+        return []
+
+    def heap_item(ix):
+        total = np.sum([keys[i] for (_, keys), i in zip(groups, ix)], axis=0)
+        return tuple(-total), ix
+
+    start = (0,) * len(groups)
+    heap, seen, top = [heap_item(start)], {start}, []
+    while len(heap) > 0 and len(top) < top_n:
+        _, ix = heapq.heappop(heap)
+        top.append(ix)
+        for g, (candidates, _) in enumerate(groups):
+            nxt = ix[:g] + (ix[g] + 1,) + ix[g + 1:]
+            if nxt[g] < len(candidates) and nxt not in seen:
+                seen.add(nxt)
+                heapq.heappush(heap, heap_item(nxt))
+
+    return [pd.concat([candidates[i] for (candidates, _), i in zip(groups, ix)]) for ix in top]
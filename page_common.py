@@ -0,0 +1,297 @@
+"""
+Sidebar options, solve flow and result panels shared by the recommendation pages: the pages only differ in the model
+they build and the weights they ask for
+"""
+import pandas as pd
+import streamlit as st
+
+from perf import span
+from solution_cache import solution_cache, solution_key
+from squad_solver import (SOLVER_BACKENDS, build_squad_model, consensus_squad, constraint_key, get_squad_solver,
+                          improve_in_background, lp_preview, objective_vector, prune_dominated, sample_weights,
+                          squad_differences, stop_improvement, sweep_transfers, weight_robustness)
+from transfer_planner import build_plan_model, plan_table, plan_transfers, weekly_projections
+
+TIME_BUDGET = 10  # seconds a rerun waits for the solver, see the "Time budget" slider
+IMPROVE_POLL = 2  # seconds between checks for a better squad from the background solve
+PREVIEW_COLUMNS = ['web_name', 'team_name', 'element_type', 'now_cost', 'total_points', 'ep_next']
+
+
+def solver_options():
+    """ Sidebar inputs of how the squads are solved, as keyword arguments of the pages' solve_group """
+    options = dict(
+        backend=st.sidebar.selectbox("Solver", list(SOLVER_BACKENDS), key='solver-backend'),
+        time_budget=st.sidebar.slider("Time budget (s)", min_value=1, max_value=60, value=TIME_BUDGET,
+                                      key='time-budget',
+                                      help="Longest the solver runs before showing the best squad found so far"),
+        keep_improving=st.sidebar.checkbox("Keep improving in the background", value=True, key='keep-improving',
+                                           help="When the time budget runs out, keeps solving and shows a better "
+                                                "squad once it is found"),
+        top_k=st.sidebar.number_input("Squads to rank", min_value=1, max_value=20, value=1, key='top-k',
+                                      help="Lists the best distinct squads and how they differ from the best one"),
+        prune=st.sidebar.checkbox("Prune dominated players", value=True, key='prune',
+                                  help="Leaves out of the model the players that cannot be in the best squads, "
+                                       "which gives the same squads faster"),
+        preview=st.sidebar.checkbox("Preview while solving", value=True, key='preview',
+                                    help="Shows a squad rounded from the LP relaxation, and how far from the "
+                                         "best squad it can be, until the solver is done"),
+        robustness=None)
+
+    if st.sidebar.checkbox("Robustness analysis", value=False, key='robustness',
+                           help="Solves again with weights sampled around the sliders and shows how often "
+                                "each player is picked"):
+        options['robustness'] = dict(
+            n_samples=st.sidebar.slider("Weight samples", min_value=50, max_value=500, value=200, step=50,
+                                        key='robustness-samples'),
+            spread=st.sidebar.slider("Weight spread", min_value=0.05, max_value=0.5, value=0.25,
+                                     key='robustness-spread'),
+            time_limit=st.sidebar.slider("Robustness time limit (s)", min_value=1, max_value=60, value=10,
+                                         key='robustness-time-limit'))
+    return options
+
+
+def transfer_options(total_players, transfers_limit, transfers_cost, current_ep):
+    """ Sidebar inputs of the transfers sweep and plan, returns (sweep, plan), each None unless its box is ticked """
+    sweep = None
+    if st.sidebar.checkbox("Sweep number of transfers", value=False, key='sweep-transfers'):
+        sweep = dict(max_transfers=st.sidebar.slider("Sweep up to", min_value=1, max_value=total_players,
+                                                     value=min(total_players, transfers_limit + 3)),
+                     transfers_limit=transfers_limit,
+                     transfers_cost=transfers_cost,
+                     current_ep=current_ep)
+
+    plan = None
+    if st.sidebar.checkbox("Plan transfers over several game weeks", value=False, key='plan-transfers'):
+        plan = dict(horizon=st.sidebar.slider("Game weeks to plan", min_value=3, max_value=6, value=5,
+                                              key='plan-horizon'),
+                    time_limit=st.sidebar.slider("Planner time limit (s)", min_value=1, max_value=30, value=5,
+                                                 key='plan-time-limit'),
+                    transfers_limit=transfers_limit,
+                    transfers_cost=transfers_cost)
+    return sweep, plan
+
+
+def watch_improvement(future):
+    """ Reruns the page once the background solve is done, polling it with st.fragment when streamlit has it """
+    if future.done():
+        return
+    st.sidebar.caption("Looking for a better squad in the background")
+    if hasattr(st, 'fragment'):
+        @st.fragment(run_every=IMPROVE_POLL)
+        def poll():
+            if future.done():
+                st.rerun()
+
+        poll()
+    else:
+        st.sidebar.button("Show the better squad, if found")
+
+
+def show_preview(model, c, df, group_names=None):
+    """
+    Squad rounded from the LP relaxation of model (see lp_preview), shown while the solver runs
+    group_names: name of each block of model (e.g. lineup and substitutes), to show the players of each block
+    Returns the placeholder holding it, to empty once the solver is done
+    """
+    placeholder = st.empty()
+    preview = lp_preview(model, c)
+    if preview.codes is not None:
+        with placeholder.container():
+            st.info("Preview from the LP relaxation while the solver runs: at most {:.1%} below the best "
+                    "squad".format(preview.gap))
+            if group_names is None:
+                st.dataframe(df.loc[preview.codes, PREVIEW_COLUMNS])
+            else:
+                st.dataframe(pd.concat([df.loc[model.selected(preview.x, block), PREVIEW_COLUMNS].assign(group=name)
+                                        for block, name in enumerate(group_names)]))
+    return placeholder
+
+
+def solve_squads(solver, c, df, backend=None, top_k=1, time_budget=TIME_BUDGET, keep=None, preview=True,
+                 group_names=None):
+    """
+    The top_k best squads of solver's model for objective c, as a list of SolveResult, best first
+    keep: mask of the players left in the model, see prune_dominated
+    preview: show a squad rounded from the LP relaxation (see show_preview) until the solver is done
+    """
+    placeholder = show_preview(solver.restricted(keep), c, df, group_names) if preview else st.empty()
+    if top_k > 1:
+        results = solver.top_k(c, top_k, backend=backend, time_limit=time_budget, keep=keep)
+    else:
+        results = [solver.solve(c, backend=backend, time_limit=time_budget, keep=keep)]
+    placeholder.empty()
+    return results
+
+
+def show_squads(solver, results, df, top_k=1, cached=False, improvement=None):
+    """
+    How the squads in results were solved, how the top_k ones differ and whether the best one is short of optimal
+    improvement: future of the background solve of a better squad (see improve_in_background), if one runs
+    """
+    if len(results) == 0:
+        return
+    if top_k > 1:
+        with st.expander("Top {} squads".format(len(results))):
+            st.dataframe(squad_differences(solver.model, results, df.web_name))
+
+    result = results[0]
+    st.sidebar.caption("{} with {} in {:.0f} ms{}".format("Cached, solved" if cached else "Solved",
+                                                          result.backend, 1000 * sum(r.seconds for r in results),
+                                                          " (warm)" if not cached and result.warm else ""))
+    if result.gap > 0:
+        st.info("Near-optimal (gap {:.1%}): the solver stopped before proving this is the best squad".format(
+            result.gap))
+    if improvement is not None:
+        watch_improvement(improvement)
+
+
+def solve_cached(df, c, build, model_args, solver_name, version, weights, backend=None, top_k=1,
+                 time_budget=TIME_BUDGET, keep_improving=False, keep=None, preview=True, group_names=None):
+    """
+    The top_k best squads for objective c (see solve_squads), from the solution cache when the same config was solved
+    before, in any session, and shows them (see show_squads); returns (solver, results)
+    build: builds the squad model from df and model_args, e.g. build_squad_model; the model is kept in the session
+        under solver_name while model_args and the constraint columns of df stay the same (see get_squad_solver)
+    version: PlayerTable.version of df, with weights, model_args, top_k and keep it makes the solution cache key
+    keep_improving: when the time budget stops the solver, keep solving in the background, cache the better squad and
+        rerun the page when it is found
+    """
+    cache = solution_cache()
+    cache_key = solution_key(version, weights=weights, top_k=top_k, prune=keep is not None, **model_args)
+    cached = cache.get(cache_key)
+    # one background solve per session, the one of a config the sliders moved away from is stopped
+    stop_improvement(st.session_state, 'squad-improver', unless=cache_key)
+    improvement = None
+    if cached is None:
+        solver = get_squad_solver(st.session_state, solver_name, key=constraint_key(df, **model_args),
+                                  build=lambda: build(df=df, **model_args))
+        results = solve_squads(solver, c, df, backend=backend, top_k=top_k, time_budget=time_budget, keep=keep,
+                               preview=preview, group_names=group_names)
+
+        # squads cut short by the time budget are not cached, a better squad from the background solve is
+        if len(results) == top_k and all(r.codes is not None and r.gap == 0 for r in results):
+            cache.put(cache_key, (solver.model, results))
+        elif keep_improving and top_k == 1:
+            def cache_improvement(improved, model=solver.model, incumbent=results[0]):
+                if improved.codes is not None and (incumbent.codes is None or
+                                                   improved.objective >= incumbent.objective):
+                    cache.put(cache_key, (model, [improved]))
+
+            improvement = improve_in_background(st.session_state, 'squad-improver', cache_key,
+                                                solver.restricted(keep), c, backend=backend,
+                                                on_done=cache_improvement)
+    else:
+        model, results = cached
+        solver = get_squad_solver(st.session_state, solver_name, key=constraint_key(df, **model_args),
+                                  build=lambda: model)
+    st.sidebar.caption("Solution cache: {} hits, {} misses ({:.0%} hit rate)".format(cache.hits, cache.misses,
+                                                                                     cache.hit_rate))
+    show_squads(solver, results, df, top_k=top_k, cached=cached is not None, improvement=improvement)
+    return solver, results
+
+
+def show_robustness(solver, df, objectives, robustness, backend=None):
+    """
+    How often each player is picked over objectives, weights sampled around the sliders, and the consensus squad
+    robustness: n_samples, spread and time_limit from solver_options
+    """
+    with st.expander("Robustness over {} sampled weights".format(robustness['n_samples']), expanded=True):
+        frequency, n_solved = weight_robustness(solver.model, objectives, backend=backend,
+                                                time_limit=robustness['time_limit'])
+        if n_solved == 0:
+            st.warning("No sampled weights solved in {} s".format(robustness['time_limit']))
+        else:
+            st.caption("{} of {} samples solved in {} s".format(n_solved, len(objectives),
+                                                               robustness['time_limit']))
+            frequency['web_name'] = df.web_name
+            st.bar_chart(frequency.nlargest(30, 'squad').set_index('web_name')[solver.model.block_names])
+            consensus = consensus_squad(solver.model, frequency, backend=backend)
+            if consensus.x is not None:
+                st.markdown("#### Consensus squad")
+                st.dataframe(frequency[solver.model.picked(consensus.x)].sort_values('squad', ascending=False))
+
+
+@span('solve_group')
+def solve_transfers(df, current_team, n_transfers, budget, total_players, players_minmax, max_players_per_team,
+                    version, group_name="group", backend=None, top_k=1, sweep=None, plan=None, robustness=None,
+                    time_budget=TIME_BUDGET, keep_improving=False, prune=True, preview=True):
+    """
+    Best squad reachable from current_team with n_transfers, for the weights of the sliders of group_name; returns
+    its codes, or None when no squad is found
+    version: PlayerTable.version of df, part of the solution cache key
+    time_budget: seconds the solver runs before the best squad found so far is shown, with its gap
+    keep_improving: when the time budget stops the solver, keep solving in the background and rerun the page when a
+        better squad is found
+    prune: fix out of the model the players that cannot be in the top_k squads (see prune_dominated); the session
+        model keeps every player, so moving a slider does not rebuild it, and the robustness analysis gets them all
+    preview: show a squad rounded from the LP relaxation, with its gap, while the solver runs
+    """
+    # the model only depends on these, so it is kept in the session while just the weight sliders move
+    model_args = dict(budget=budget, total_players=total_players, players_minmax=players_minmax,
+                      max_players_per_team=max_players_per_team, current_team=current_team, n_transfers=n_transfers)
+
+    with st.sidebar:
+        st.markdown("### {} ".format(group_name))
+
+        w_points = st.slider("Total Points", min_value=0, max_value=10, value=10,
+                             key='{}-{}'.format(group_name, 'points'))
+        w_cost = st.slider("Cost", min_value=0, max_value=10, value=1, key='{}-{}'.format(group_name, 'cost'))
+        w_ep = st.slider("Expected Points Next Round", min_value=0, max_value=10, value=5,
+                         key='{}-{}'.format(group_name, 'ep'))
+        w_form = st.slider("Form", min_value=0, max_value=10, value=3,
+                           key='{}-{}'.format(group_name, 'form'))
+
+        w_selected = st.slider("Selected by Percent", min_value=0, max_value=10, value=3,
+                               key='{}-{}'.format(group_name, 'selected'))
+        w_bonus = st.slider("Bonus Points", min_value=0, max_value=10, value=1, key='{}-{}'.format(group_name, 'bonus'))
+        w_dreamteam = st.slider("Times in Dreamteam", min_value=0, max_value=10, value=1,
+                                key='{}-{}'.format(group_name, 'dreamteam'))
+
+    weights = dict(total_points=w_points, now_cost=w_cost, ep_next=w_ep, form=w_form,
+                   selected_by_percent=w_selected, bonus=w_bonus, dreamteam_count=w_dreamteam)
+
+    c = objective_vector(df, weights)
+    keep = None
+    if prune:
+        keep = prune_dominated(df, [c], {p: v[1] for p, v in players_minmax.items()}, total_players,
+                               max_players_per_team, current_team=current_team, depth=top_k)
+        st.sidebar.caption("Pruned to {} of {} players".format(keep.sum(), len(df)))
+
+    solver, results = solve_cached(df, c, build_squad_model, model_args, 'squad-solver-{}'.format(group_name), version,
+                                   weights, backend=backend, top_k=top_k, time_budget=time_budget,
+                                   keep_improving=keep_improving, keep=keep, preview=preview)
+    if len(results) == 0:
+        return None
+
+    if sweep is not None:
+        with st.expander("Number of transfers sweep", expanded=True):
+            df_sweep = sweep_transfers(solver.restricted(keep), c, df, total_players=total_players, backend=backend,
+                                       **sweep)
+            st.scatter_chart(df_sweep.reset_index(), x='point_cost', y='ep_gain', color='pareto')
+            st.dataframe(df_sweep.style.highlight_max(subset=['net_gain']))
+
+    if plan is not None:
+        with st.expander("Transfer plan for the next {} game weeks".format(plan['horizon']), expanded=True):
+            plan_args = dict(budget=budget, total_players=total_players, players_minmax=players_minmax,
+                             max_players_per_team=max_players_per_team, current_team=current_team,
+                             horizon=plan['horizon'], transfers_limit=plan['transfers_limit'])
+            planner = get_squad_solver(st.session_state, 'transfer-planner-{}'.format(group_name),
+                                       key=constraint_key(df, **plan_args),
+                                       build=lambda: build_plan_model(df=df, **plan_args))
+            projections = weekly_projections(df, plan['horizon'])
+            plan_result = plan_transfers(planner, projections, plan['transfers_cost'], current_team,
+                                         plan['transfers_limit'], backend=backend, time_limit=plan['time_limit'])
+            if plan_result.codes is None:
+                st.warning("No transfer plan found in {} s: {}".format(plan['time_limit'], plan_result.status))
+            else:
+                st.caption("Projected points {:.1f}, gap to the best bound {:.1%}, solved with {} in {:.1f} s".format(
+                    plan_result.objective, plan_result.gap, plan_result.backend, plan_result.seconds))
+                st.dataframe(plan_table(planner.model, plan_result.x, df.web_name, projections,
+                                        plan['transfers_cost'], current_team, plan['transfers_limit']))
+
+    if robustness is not None:
+        objectives = [objective_vector(df, w) for w in sample_weights(weights, robustness['n_samples'],
+                                                                      spread=robustness['spread'])]
+        show_robustness(solver, df, objectives, robustness, backend=backend)
+
+    return results[0].codes
@@ -1,7 +1,11 @@
 import streamlit as st
 from fpldata import FPLData
-from get_data import get_data
-import pulp
+from get_data import get_data_and_table, wrap_fpl
+from page_common import TIME_BUDGET, show_robustness, solve_cached, solver_options
+from perf import performance_panel, rerun, span
+from photo_cache import photo_cache
+from squad_solver import build_lineup_bench_model, objective_vector, prune_dominated, sample_weights
+import numpy as np
 import random
 
 # Team recommendation with Linear Programming based on https://statnamara.wordpress.com/2021/02/05/finding-the-best-lazy-fantasy-football-team-using-pulp-in-python/
@@ -9,7 +13,6 @@ import random
 st.set_page_config(page_title=None, page_icon='images/roboklopp_eye.jpeg', layout="wide", initial_sidebar_state="auto",
                    menu_items=None)
 
-PHOTO_URL = "https://resources.premierleague.com/premierleague/photos/players/110x140/p{}.png"
 player_columns = ['type_name', 'web_name', 'full_name', 'team_name', 'now_cost', 'total_points', 'ep_next',
                   'selected_by_percent', 'bonus', 'dreamteam_count', 'element_type']
 
@@ -19,38 +22,7 @@ map_pos_num = {'Goalkeeper': 1, 'Defender': 2, 'Midfielder': 3, 'Forward': 4}
 map_num_pos = {1: 'Goalkeeper', 2: 'Defender', 3: 'Midfielder', 4: 'Forward'}
 
 
-def solve_group(df, budget, total_players, players_minmax, max_players_per_team, group_name="group"):
-    # Create the model
-    model = pulp.LpProblem(name="create-{}".format(group_name), sense=pulp.LpMaximize, )
-
-    codes = df.index.to_list()
-
-    group = pulp.LpVariable.dict("group", codes, 0, 1, cat=pulp.LpInteger)
-
-    # Add the constraints to the model
-    # Lineup constraints
-    model += (sum(df.now_cost.loc[c] * group[c] for c in codes) <= budget, "Lineup budget")
-    model += (sum(group[c] for c in codes) == total_players, "Max {} lineup".format(total_players))
-    for player_type in players_minmax:
-        min_val, max_val = players_minmax[player_type]
-        element_type = map_pos_num[player_type]
-        if min_val == max_val:
-            model += (sum(group[c] for c in codes if df.element_type.loc[c] == element_type) == min_val,
-                      "Val {} {} in lineup".format(min_val, player_type))
-        else:
-            model += (sum(group[c] for c in codes if df.element_type.loc[c] == element_type) >= min_val,
-                      "Min {} {} in lineup".format(min_val, player_type))
-            model += (sum(group[c] for c in codes if df.element_type.loc[c] == element_type) <= max_val,
-                      "Max {} {} in lineup".format(max_val, player_type))
-    # Max players per team
-    for team in df.team_name.unique():
-        model += (sum(group[c] for c in codes if df.team_name.loc[c] == team) <= max_players_per_team[team],
-                  "Max {} players per team in {}".format(max_players_per_team[team], team))
-
-    # change of playing next round for all players is 100%
-    model += (sum(df.chance_of_playing_next_round.loc[c] * group[c] for c in codes) == 100 * total_players,
-              "Chance of playing next round is 100%")
-
+def weight_sliders(group_name):
     with st.sidebar:
         st.markdown("### {} ".format(group_name))
 
@@ -65,21 +37,54 @@ def solve_group(df, budget, total_players, players_minmax, max_players_per_team,
         w_dreamteam = st.slider("Times in Dreamteam", min_value=0, max_value=10, value=1,
                                 key='{}-{}'.format(group_name, 'dreamteam'))
 
-    model += pulp.lpSum([w_points * df.total_points.loc[c] * group[c],
-                         w_cost * df.now_cost.loc[c] * group[c],
-                         w_ep * df.ep_next.loc[c] * group[c],
-                         w_selected * df.selected_by_percent.loc[c] * group[c],
-                         w_bonus * df.bonus.loc[c] * group[c],
-                         w_dreamteam * df.dreamteam_count.loc[c] * group[c]] for c in codes)
-
-    # Solve the problem
-    # st.write(pulp.listSolvers(onlyAvailable=True))
-    # status = model.solve(solver=pulp.GLPK(msg=False))
-    status = model.solve()
-    if status == pulp.LpStatusOptimal:
-        return [c for c in codes if pulp.value(group[c]) == 1]
-    else:
-        return None
+    return dict(total_points=w_points, now_cost=w_cost, ep_next=w_ep,
+                selected_by_percent=w_selected, bonus=w_bonus, dreamteam_count=w_dreamteam)
+
+
+@span('solve_group')
+def solve_group(df, squad_budget, lineup_budget, squad_players, lineup_minmax, max_players_per_team, version,
+                group_names=("Main Lineup", "Substitutes"), backend=None, top_k=1, robustness=None,
+                time_budget=TIME_BUDGET, keep_improving=False, prune=True, preview=True):
+    """
+    Picks lineup and substitutes in a single model, returns (lineup codes, substitutes codes)
+    version: PlayerTable.version of df, part of the solution cache key
+    time_budget: seconds the solver runs before the best squad found so far is shown, with its gap
+    keep_improving: when the time budget stops the solver, keep solving in the background and rerun the page when a
+        better squad is found
+    prune: fix out of the model the players that cannot be in the top_k squads (see prune_dominated); the session
+        model keeps every player, so moving a slider does not rebuild it, and the robustness analysis gets them all
+    preview: show a squad rounded from the LP relaxation, with its gap, while the solver runs
+    """
+    # the model only depends on these, so it is kept in the session while just the weight sliders move
+    model_args = dict(squad_budget=squad_budget, lineup_budget=lineup_budget, squad_players=squad_players,
+                      lineup_minmax=lineup_minmax, max_players_per_team=max_players_per_team)
+
+    group_weights = [weight_sliders(group_name) for group_name in group_names]
+    objectives = [objective_vector(df, weights) for weights in group_weights]
+    c = np.concatenate(objectives)
+    keep = None
+    if prune:
+        keep = prune_dominated(df, objectives, squad_players, sum(squad_players.values()), max_players_per_team,
+                               depth=top_k)
+        st.sidebar.caption("Pruned to {} of {} players".format(keep.sum(), len(df)))
+
+    solver, results = solve_cached(df, c, build_lineup_bench_model, model_args, 'squad-solver-new-team', version,
+                                   dict(zip(group_names, group_weights)), backend=backend, top_k=top_k,
+                                   time_budget=time_budget, keep_improving=keep_improving, keep=keep, preview=preview,
+                                   group_names=group_names)
+    if len(results) == 0:
+        return None, None
+
+    if robustness is not None:
+        samples = [sample_weights(weights, robustness['n_samples'], spread=robustness['spread'])
+                   for weights in group_weights]
+        objectives = [np.concatenate([objective_vector(df, weights) for weights in sample]) for sample in zip(*samples)]
+        show_robustness(solver, df, objectives, robustness, backend=backend)
+
+    result = results[0]
+    if result.codes is None:
+        return None, None
+    return solver.model.selected(result.x, block=0), solver.model.selected(result.x, block=1)
 
 
 def main():
@@ -97,21 +102,19 @@ def main():
                  "humans coaches are overrated" -- Robo Klopp   
              """)
 
-    fpl = FPLData(convert_to_dataframes=True)
-
-    _, _, df_elements, _, _ = get_data(fpl)
-
-    df_elements['photo_url'] = df_elements['code'].apply(lambda x: PHOTO_URL.format(x))
+    fpl = wrap_fpl(FPLData(convert_to_dataframes=True))
 
-    df_elements.selected_by_percent = df_elements.selected_by_percent.astype(float)
-    df_elements.ep_next = df_elements.ep_next.astype(float)
+    (_, _, df_elements, _, _), players = get_data_and_table(fpl)
 
-    df_elements.now_cost = df_elements.now_cost.astype(float)
+    with span('photos'):
+        photos = photo_cache()
+        photos.prefetch(players.codes)
+        df_elements['photo_url'] = df_elements['code'].apply(photos.photo)
 
     df_elements = df_elements.set_index("code")
-    df_to_score = df_elements.copy()
+    df_to_score = players.frame()
 
-    other_columns = df_to_score.columns.difference(player_columns).to_list()
+    other_columns = df_elements.columns.difference(player_columns).to_list()
 
     min_player_cost = int(df_elements.now_cost.min())
 
@@ -136,66 +139,49 @@ def main():
 
     max_players_per_team = {team: PLAYERS_PER_TEAM for team in df_to_score.team_name.unique()}
 
-    lineup = solve_group(df=df_to_score,
-                         budget=lineup_budget,
-                         total_players=lineup_total_players,
-                         players_minmax=lineup_minmax,
-                         max_players_per_team=max_players_per_team,
-                         group_name='Main Lineup')
+    options = solver_options()
+
+    lineup, subs = solve_group(df=df_to_score,
+                               squad_budget=squad_budget,
+                               lineup_budget=lineup_budget,
+                               squad_players=squad_players,
+                               lineup_minmax=lineup_minmax,
+                               max_players_per_team=max_players_per_team,
+                               version=players.version,
+                               **options)
 
     if lineup is None:
         st.write("No lineup found or problem is infeasible")
+        return None
 
     df_lineup = df_elements.loc[lineup]
 
     st.markdown("### Line Up")
 
-    cols = st.columns(len(df_lineup))
-    for i, col in enumerate(cols):
-        with col:
-            st.image(df_lineup.iloc[i].photo_url)
-            st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(name=df_lineup.iloc[i].web_name),
-                        unsafe_allow_html=True)
+    with span('render_photos'):
+        cols = st.columns(len(df_lineup))
+        for i, col in enumerate(cols):
+            with col:
+                st.image(df_lineup.iloc[i].photo_url)
+                st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(
+                    name=df_lineup.iloc[i].web_name), unsafe_allow_html=True)
 
     st.dataframe(
         df_lineup[player_columns + other_columns].sort_values(by=['element_type', 'total_points'], ascending=False))
 
-    # count how many players are in each position in df_lineup
-    _df_lineup_pos = df_lineup.groupby('element_type').count()
-    _df_lineup_pos.index = _df_lineup_pos.index.map(map_num_pos)
-
-    lineup_pos = _df_lineup_pos['type_name'].to_dict()
-
-    lineup_final_budget = sum(df_lineup.now_cost)
-    subs_minmax = {pos: (squad_players[pos] - _pos_lineup, squad_players[pos] - _pos_lineup) for pos, _pos_lineup in
-                   lineup_pos.items()}
-
-    max_players_per_team = {team: PLAYERS_PER_TEAM - sum(df_lineup.team_name == team) for team in
-                            df_to_score.team_name.unique()}
-
-    subs = solve_group(df=df_to_score.loc[df_to_score.index.difference(lineup)],
-                       budget=squad_budget - lineup_final_budget,
-                       total_players=subs_total_players,
-                       players_minmax=subs_minmax,
-                       max_players_per_team=max_players_per_team,
-                       group_name='Substitutes')
-
-    if subs is None:
-        st.write("No subs found")
-        return None
-
     df_subs = df_elements.loc[subs]
 
     st.markdown("### Substitutes")
 
-    cols = st.columns(len(df_lineup))
-    for i, col in enumerate(cols):
-        if i >= len(df_subs):
-            break
-        with col:
-            st.image(df_subs.iloc[i].photo_url)
-            st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(name=df_subs.iloc[i].web_name),
-                        unsafe_allow_html=True)
+    with span('render_photos'):
+        cols = st.columns(len(df_lineup))
+        for i, col in enumerate(cols):
+            if i >= len(df_subs):
+                break
+            with col:
+                st.image(df_subs.iloc[i].photo_url)
+                st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(
+                    name=df_subs.iloc[i].web_name), unsafe_allow_html=True)
 
     st.dataframe(
         df_subs[player_columns + other_columns].sort_values(by=['element_type', 'total_points'], ascending=False))
@@ -216,4 +202,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with rerun("New Team Recommendation", st.session_state):
+        main()
+    performance_panel(st.session_state)
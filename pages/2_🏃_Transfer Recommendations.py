@@ -3,15 +3,17 @@ import random
 import requests.exceptions
 import streamlit as st
 from fpldata import FPLData
-from get_data import get_data
-import pulp
+from get_data import get_data_and_table, wrap_fpl
+from page_common import solver_options, solve_transfers, transfer_options
+from perf import performance_panel, rerun, span
+from photo_cache import photo_cache
 
 # Team recommendation with Linear Programming based on https://statnamara.wordpress.com/2021/02/05/finding-the-best-lazy-fantasy-football-team-using-pulp-in-python/
 
 st.set_page_config(page_title=None, page_icon='images/roboklopp_eye.jpeg', layout="wide", initial_sidebar_state="auto",
                    menu_items=None)
 
-PHOTO_URL = "https://resources.premierleague.com/premierleague/photos/players/110x140/p{}.png"
+THUMBNAIL_WIDTH = 100
 player_columns = ['type_name', 'web_name', 'full_name', 'team_name', 'now_cost', 'total_points', 'ep_next', 'form',
                   'selected_by_percent', 'bonus', 'dreamteam_count', 'element_type']
 
@@ -21,78 +23,6 @@ map_pos_num = {'Goalkeeper': 1, 'Defender': 2, 'Midfielder': 3, 'Forward': 4}
 map_num_pos = {1: 'Goalkeeper', 2: 'Defender', 3: 'Midfielder', 4: 'Forward'}
 
 
-def solve_group(df, current_team, n_transfers, budget, total_players, players_minmax, max_players_per_team,
-                group_name="group"):
-    # Create the model
-    model = pulp.LpProblem(name="create-{}".format(group_name), sense=pulp.LpMaximize, )
-
-    codes = df.index.to_list()
-
-    group = pulp.LpVariable.dict("group", codes, 0, 1, cat=pulp.LpInteger)
-
-    # Add the constraints to the model
-    # Lineup constraints
-    model += (sum(df.now_cost.loc[c] * group[c] for c in codes) <= budget, "Lineup budget")
-    model += (sum(group[c] for c in codes) == total_players, "Max {} lineup".format(total_players))
-    for player_type in players_minmax:
-        min_val, max_val = players_minmax[player_type]
-        element_type = map_pos_num[player_type]
-        if min_val == max_val:
-            model += (sum(group[c] for c in codes if df.element_type.loc[c] == element_type) == min_val,
-                      "Val {} {} in lineup".format(min_val, player_type))
-        else:
-            model += (sum(group[c] for c in codes if df.element_type.loc[c] == element_type) >= min_val,
-                      "Min {} {} in lineup".format(min_val, player_type))
-            model += (sum(group[c] for c in codes if df.element_type.loc[c] == element_type) <= max_val,
-                      "Max {} {} in lineup".format(max_val, player_type))
-    # Max players per team
-    for team in df.team_name.unique():
-        model += (sum(group[c] for c in codes if df.team_name.loc[c] == team) <= max_players_per_team[team],
-                  "Max {} players per team in {}".format(max_players_per_team[team], team))
-
-    # change of playing next round for all players is 100%
-    model += (sum(df.chance_of_playing_next_round.loc[c] * group[c] for c in codes) == 100 * total_players,
-              "Chance of playing next round is 100%")
-
-    model += (
-        sum(group[c] for c in current_team) == total_players - n_transfers,
-        "Keeping all by {} players".format(n_transfers))
-
-    with st.sidebar:
-        st.markdown("### {} ".format(group_name))
-
-        w_points = st.slider("Total Points", min_value=0, max_value=10, value=10,
-                             key='{}-{}'.format(group_name, 'points'))
-        w_cost = st.slider("Cost", min_value=0, max_value=10, value=1, key='{}-{}'.format(group_name, 'cost'))
-        w_ep = st.slider("Expected Points Next Round", min_value=0, max_value=10, value=5,
-                         key='{}-{}'.format(group_name, 'ep'))
-        w_form = st.slider("Form", min_value=0, max_value=10, value=3,
-                         key='{}-{}'.format(group_name, 'form'))
-
-        w_selected = st.slider("Selected by Percent", min_value=0, max_value=10, value=3,
-                               key='{}-{}'.format(group_name, 'selected'))
-        w_bonus = st.slider("Bonus Points", min_value=0, max_value=10, value=1, key='{}-{}'.format(group_name, 'bonus'))
-        w_dreamteam = st.slider("Times in Dreamteam", min_value=0, max_value=10, value=1,
-                                key='{}-{}'.format(group_name, 'dreamteam'))
-
-    model += pulp.lpSum([w_points * df.total_points.loc[c] * group[c],
-                         w_cost * df.now_cost.loc[c] * group[c],
-                         w_ep * df.ep_next.loc[c] * group[c],
-                         w_form * df.form.loc[c] * group[c],
-                         w_selected * df.selected_by_percent.loc[c] * group[c],
-                         w_bonus * df.bonus.loc[c] * group[c],
-                         w_dreamteam * df.dreamteam_count.loc[c] * group[c]] for c in codes)
-
-    # Solve the problem
-    # st.write(pulp.listSolvers(onlyAvailable=True))
-    # status = model.solve(solver=pulp.GLPK(msg=False))
-    status = model.solve()
-    if status == pulp.LpStatusOptimal:
-        return [c for c in codes if pulp.value(group[c]) == 1]
-    else:
-        return None
-
-
 def main():
     col1, col2 = st.columns([1, 3])
     with col1:
@@ -120,22 +50,19 @@ def main():
 
     pl_profile_cookie = st.text_input(label="Cookie: pl_profile=")
 
-    fpl = FPLData(convert_to_dataframes=True, pl_profile_cookie=pl_profile_cookie)
+    fpl = wrap_fpl(FPLData(convert_to_dataframes=True, pl_profile_cookie=pl_profile_cookie))
 
-    _, game_week, df_elements, _, _ = get_data(fpl)
+    (_, game_week, df_elements, _, _), players = get_data_and_table(fpl)
 
     df_elements['element'] = df_elements.index.values
-    df_elements['photo_url'] = df_elements['code'].apply(lambda x: PHOTO_URL.format(x))
-
-    df_elements.selected_by_percent = df_elements.selected_by_percent.astype(float)
-    df_elements.ep_next = df_elements.ep_next.astype(float)
-    df_elements.form = df_elements.form.astype(float)
 
-    df_elements.now_cost = df_elements.now_cost.astype(float)
-
-    # df_elements = df_elements.set_index("code")
-    df_to_score = df_elements.copy().set_index("code")
-    other_columns = df_to_score.columns.difference(player_columns).to_list()
+    with span('photos'):
+        photos = photo_cache()
+        photos.prefetch(players.codes)
+        df_elements['photo_url'] = df_elements['code'].apply(photos.photo)
+        df_elements['thumbnail_url'] = df_elements['code'].apply(lambda x: photos.photo(x, width=THUMBNAIL_WIDTH))
+    df_to_score = players.frame()
+    other_columns = df_elements.columns.difference(player_columns + ['code']).to_list()
 
     # Configurations for players
     squad_total_players = 15
@@ -148,12 +75,14 @@ def main():
 
     if (my_team_num != "") and (pl_profile_cookie != ""):
         try:
-            my_team = fpl.fetch_my_team(my_team=my_team_num)
+            with span('fetch_my_team'):
+                my_team = fpl.fetch_my_team(my_team=my_team_num)
         except requests.exceptions.JSONDecodeError:
             st.error("Something wrong in your log in information.")
             return
 
-        capt_ = fpl.fetch_managers([my_team_num])[my_team_num].iloc[0]
+        with span('fetch_managers'):
+            capt_ = fpl.fetch_managers([my_team_num])[my_team_num].iloc[0]
 
         captain_name = capt_.player_first_name + " " + capt_.player_last_name
         squad_name = capt_["name"]
@@ -175,6 +104,8 @@ def main():
 
         max_players_per_team = {team: PLAYERS_PER_TEAM for team in df_to_score.team_name.unique()}
 
+        options = solver_options()
+
         st.markdown("""
         ***
         ## Current squad: _{squad_name}_ by _{captain_name}_
@@ -182,30 +113,38 @@ def main():
         """.format(squad_name=squad_name, captain_name=captain_name))
 
         # with st.expander("Squad Photos"):
-        for i, col in enumerate(st.columns(len(df_my_team))):
-            with col:
-                player = df_my_team.iloc[i]
-                st.image(player.photo_url)
-                if player.is_captain == 1:
-                    st.markdown("**(C)**")
-                elif player.is_vice_captain == 1:
-                    st.markdown("**(VC)**")
-                st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(name=player.web_name),
-                            unsafe_allow_html=True)
-
-            # st.dataframe(df_my_team)
+        with span('render_photos'):
+            for i, col in enumerate(st.columns(len(df_my_team))):
+                with col:
+                    player = df_my_team.iloc[i]
+                    st.image(player.photo_url)
+                    if player.is_captain == 1:
+                        st.markdown("**(C)**")
+                    elif player.is_vice_captain == 1:
+                        st.markdown("**(VC)**")
+                    st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(name=player.web_name),
+                                unsafe_allow_html=True)
+
+                # st.dataframe(df_my_team)
 
         n_transfers = st.sidebar.slider("Number of Transfers", min_value=0, max_value=squad_total_players,
                                         value=my_team_transfers_limit)
 
-        lineup = solve_group(df=df_to_score,
-                             current_team=list(df_my_team.code),
-                             n_transfers=n_transfers,
-                             budget=my_team_value + my_team_bank,
-                             total_players=squad_total_players,
-                             players_minmax=squad_players,
-                             max_players_per_team=max_players_per_team,
-                             group_name='Weights')
+        sweep, plan = transfer_options(squad_total_players, my_team_transfers_limit, my_team_transfers_cost,
+                                       sum(df_my_team.ep_next))
+
+        lineup = solve_transfers(df=df_to_score,
+                                 current_team=list(df_my_team.code),
+                                 n_transfers=n_transfers,
+                                 budget=my_team_value + my_team_bank,
+                                 total_players=squad_total_players,
+                                 players_minmax=squad_players,
+                                 max_players_per_team=max_players_per_team,
+                                 group_name='Weights',
+                                 sweep=sweep,
+                                 plan=plan,
+                                 version=players.version,
+                                 **options)
 
         if lineup is None:
             st.markdown("""
@@ -232,14 +171,14 @@ def main():
                 st.markdown("#### Replace players ####")
 
                 for player in df_my_team_not_in_lineup.itertuples():
-                    st.image(player.photo_url, width=100)
+                    st.image(player.thumbnail_url, width=THUMBNAIL_WIDTH)
                     st.markdown(player.web_name)
 
             with col2:
                 st.markdown("#### with players ####")
 
                 for player in df_lineup_not_in_my_team.itertuples():
-                    st.image(player.photo_url, width=100)
+                    st.image(player.thumbnail_url, width=THUMBNAIL_WIDTH)
                     st.markdown(player.web_name)
 
         _ep_top = df_lineup.sort_values(['ep_next', 'total_points', 'form'], ascending=False)
@@ -248,17 +187,18 @@ def main():
 
         st.markdown("### New Team")
 
-        cols = st.columns(len(df_lineup))
-        for i, col in enumerate(cols):
-            with col:
-                player = df_lineup.iloc[i]
-                st.image(player.photo_url)
-                if player.web_name == lu_captain:
-                    st.markdown("**(C)**")
-                elif player.web_name == lu_vice_captain:
-                    st.markdown("**(VC)**")
-                st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(name=player.web_name),
-                            unsafe_allow_html=True)
+        with span('render_photos'):
+            cols = st.columns(len(df_lineup))
+            for i, col in enumerate(cols):
+                with col:
+                    player = df_lineup.iloc[i]
+                    st.image(player.photo_url)
+                    if player.web_name == lu_captain:
+                        st.markdown("**(C)**")
+                    elif player.web_name == lu_vice_captain:
+                        st.markdown("**(VC)**")
+                    st.markdown("<div style='writing-mode: vertical-rl;'>{name}</div>".format(name=player.web_name),
+                                unsafe_allow_html=True)
 
         st.dataframe(
             df_lineup[player_columns + other_columns].sort_values(by=['ep_next', 'element_type', 'total_points'], ascending=False))
@@ -292,4 +232,6 @@ def main():
             st.markdown(f"Returned {r.status_code} {r.reason}")
 
 if __name__ == "__main__":
-    main()
+    with rerun("Transfer Recommendations", st.session_state):
+        main()
+    performance_panel(st.session_state)
@@ -0,0 +1,168 @@
+"""
+Span timing of the hot paths of a page run: fetching and building the snapshot, building and solving the squad
+models, rendering. Spans nest, and are summed per path (e.g. solve_group/solve/highs) for every run of a page
+script, so a rerun that solves three times shows one line with three calls.
+
+    with perf.rerun("Transfer Recommendations", st.session_state):
+        main()
+    perf.performance_panel(st.session_state)
+
+Spans only count in the thread of a rerun, anywhere else (background refresh, photo prefetch, worker processes)
+they cost a thread local lookup. With ROBOKLOPP_PERF_LOG set every rerun is appended to that file as a json line,
+and python perf.py <file> prints the p50 and p95 of every stage over the reruns it holds.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+PERF_LOG = os.environ.get('ROBOKLOPP_PERF_LOG')  # e.g. .cache/roboklopp/perf.jsonl, not written when unset
+PERF_HISTORY = 50  # reruns kept in the session for the panel
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+class Rerun:
+    """
+    Spans of one run of a page script
+    spans: path -> [calls, seconds, depth], in the order the spans were first opened
+    """
+
+    def __init__(self, page, session):
+        self.page = page
+        self.session = session
+        self.started = time.time()
+        self.seconds = None
+        self.spans = {}
+        self._stack = []
+        self._start = time.perf_counter()
+
+    def open(self, name):
+        self._stack.append(name)
+        path = "/".join(self._stack)
+        if path not in self.spans:
+            self.spans[path] = [0, 0.0, len(self._stack) - 1]
+        return path
+
+    def close(self, path, seconds):
+        self._stack.pop()
+        self.spans[path][0] += 1
+        self.spans[path][1] += seconds
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._start
+
+    def to_record(self):
+        return dict(time=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)), page=self.page,
+                    session=self.session, seconds=self.seconds,
+                    spans={path: dict(calls=calls, seconds=seconds)
+                           for path, (calls, seconds, _) in self.spans.items()})
+
+    def table(self):
+        """ DataFrame of the spans, indented by depth, with their share of the rerun """
+        df = pd.DataFrame([dict(stage=" " * depth + path.rsplit("/", 1)[-1], calls=calls, ms=1000 * seconds,
+                                share=seconds / self.seconds if self.seconds else float('nan'))
+                           for path, (calls, seconds, depth) in self.spans.items()])
+        return df if len(df) == 0 else df.set_index('stage')
+
+
+@contextmanager
+def span(name):
+    """ Times the block (or, as a decorator, the function) as name, nested under the spans open around it """
+    current = getattr(_local, 'rerun', None)
+    if current is None:
+        yield
+        return
+
+    path = current.open(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.close(path, time.perf_counter() - start)
+
+
+@contextmanager
+def rerun(page, store):
+    """
+    Records the spans of this thread while the block runs, also when it ends with st.stop or st.rerun
+    store: dict like object that survives reruns, e.g. st.session_state; keeps the last PERF_HISTORY reruns
+    """
+    if store.get('perf-session') is None:
+        store['perf-session'] = uuid.uuid4().hex[:12]
+    if store.get('perf-reruns') is None:
+        store['perf-reruns'] = deque(maxlen=PERF_HISTORY)
+
+    current = _local.rerun = Rerun(page, store['perf-session'])
+    try:
+        yield current
+    finally:
+        _local.rerun = None
+        current.finish()
+        store['perf-reruns'].append(current)
+        if PERF_LOG is not None:
+            export([current], PERF_LOG)
+
+
+def export(reruns, fn):
+    """ Appends reruns to fn, one json line each; safe to call from every session of the process """
+    lines = "".join(json.dumps(r.to_record()) + "\n" for r in reruns)
+    with _log_lock:
+        os.makedirs(os.path.dirname(os.path.abspath(fn)), exist_ok=True)
+        with open(fn, 'a') as f:
+            f.write(lines)
+
+
+def percentiles(records, q=(0.5, 0.95)):
+    """ Milliseconds per page and stage at the quantiles q over the rerun records (see Rerun.to_record) """
+    rows = []
+    for r in records:
+        rows.append(dict(page=r['page'], stage='(rerun)', ms=1000 * r['seconds']))
+        rows += [dict(page=r['page'], stage=path, ms=1000 * s['seconds']) for path, s in r['spans'].items()]
+    if len(rows) == 0:
+        return pd.DataFrame()
+    grouped = pd.DataFrame(rows).groupby(['page', 'stage'], sort=False).ms
+    df = grouped.quantile(list(q)).unstack()
+    df.columns = ["p{:g}".format(100 * v) for v in q]
+    df.insert(0, 'reruns', grouped.size())
+    return df
+
+
+def performance_panel(store):
+    """ Collapsible sidebar panel with the spans of the last rerun and the percentiles of the session """
+    import streamlit as st  # the solvers and get_data use this module without streamlit
+
+    reruns = store.get('perf-reruns')
+    if not reruns:
+        return
+    last = reruns[-1]
+    with st.sidebar.expander("Performance", expanded=False):
+        st.caption("Last rerun of {}: {:.0f} ms".format(last.page, 1000 * last.seconds))
+        st.dataframe(last.table().style.format(dict(ms="{:.1f}", share="{:.0%}")))
+        if len(reruns) > 1:
+            st.caption("Last {} reruns of this session (ms)".format(len(reruns)))
+            st.dataframe(percentiles([r.to_record() for r in reruns]).round(1))
+        st.download_button("Download json lines", "".join(json.dumps(r.to_record()) + "\n" for r in reruns),
+                           file_name="perf.jsonl", mime="application/json")
+
+
+def main(fn):
+    with open(fn) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    with pd.option_context('display.max_rows', None, 'display.width', 120, 'display.float_format', '{:.1f}'.format):
+        print(percentiles(records))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', nargs='?', default=PERF_LOG, help="json lines written with ROBOKLOPP_PERF_LOG")
+    args = parser.parse_args()
+
+    main(fn=args.log)
@@ -0,0 +1,200 @@
+"""
+Player photos kept on disk, so the pages show local files instead of sending every browser to the premier league
+servers. Photos are downloaded concurrently for all players of a snapshot, and resized (with Pillow, when installed)
+to the widths the pages use.
+
+    python photo_cache.py --workers 16
+
+Photos that are not cached yet are shown from the server while they download, the ones it does not have (404) or
+that cannot be fetched in offline replay are shown as a placeholder. With ROBOKLOPP_FPL_MODE=record the
+downloaded photos are also stored with the API recordings, and with ROBOKLOPP_FPL_MODE=replay they are fetched from
+ROBOKLOPP_REPLAY_URL (see fpl_stub_server.py) or read from the recordings when no url is set, so nothing goes to the
+network. ROBOKLOPP_PHOTO_URL overrides the server photos are downloaded from.
+"""
+import argparse
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from fpldata import FPLData
+from get_data import CACHE_DIR, FPL_MODE, RECORD_DIR, REPLAY_URL, get_player_table, wrap_fpl
+
+try:
+    from PIL import Image
+except ImportError:  # photos are kept at their original size
+    Image = None
+
+PHOTO_URL = "https://resources.premierleague.com"
+PHOTO_ENDPOINT = "premierleague/photos/players/110x140/p{}.png"
+PHOTO_DIR = os.path.join(CACHE_DIR, 'photos')
+PHOTO_WIDTHS = (100,)  # widths passed to st.image on the pages, besides the original 110 px
+PLACEHOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images', 'roboklopp_eye.jpeg')
+PREFETCH_WORKERS = 16
+
+
+def _default_base_url():
+    if os.environ.get('ROBOKLOPP_PHOTO_URL') is not None:
+        return os.environ['ROBOKLOPP_PHOTO_URL']
+    if FPL_MODE == 'replay':
+        return REPLAY_URL  # None: offline, photos are read from the recordings
+    return PHOTO_URL
+
+
+class PhotoCache:
+    """
+    Photos of the players by code, as local files for st.image
+    path: directory with the downloaded photos (p<code>.png) and their thumbnails (p<code>-w<width>.png)
+    base_url: server the photos are downloaded from, by default ROBOKLOPP_PHOTO_URL, the replay url in replay mode or
+        the premier league server; in replay mode without a replay url the photos are read from record_path
+    record: also store the downloaded photos under record_path, laid out like the urls
+    """
+
+    def __init__(self, path=PHOTO_DIR, base_url=None, widths=PHOTO_WIDTHS, workers=PREFETCH_WORKERS,
+                 record=FPL_MODE == 'record', record_path=RECORD_DIR):
+        self.path = path
+        self.base_url = _default_base_url() if base_url is None else base_url
+        self.base_url = None if self.base_url is None else self.base_url.rstrip('/')
+        self.widths = tuple(widths)
+        self.record = record
+        self.record_path = record_path
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='photo-prefetch')
+        self._lock = threading.RLock()  # a download that is already done runs its callback in prefetch
+        self._pending = {}  # code -> future of the download in flight
+        self._missing = set()  # codes without a photo upstream, not asked for again
+
+    def photo(self, code, width=None):
+        """
+        Local file with the photo of code at width (the original size when None); while it is not cached, its url on
+        base_url (and its download is started), or the placeholder when there is no photo upstream or no base_url
+        """
+        for fn in [self._file(code, width), self._file(code)]:  # photos cached before Pillow had no thumbnails
+            if os.path.exists(fn):
+                return fn
+        if self.base_url is None or int(code) in self._missing:
+            return self.placeholder(width)
+        self.prefetch([code])
+        return "{}/{}".format(self.base_url, PHOTO_ENDPOINT.format(code))
+
+    def placeholder(self, width=None):
+        if Image is None or width is None:
+            return PLACEHOLDER
+        fn = os.path.join(self.path, "placeholder-w{}.png".format(width))
+        if not os.path.exists(fn):
+            os.makedirs(self.path, exist_ok=True)
+            with Image.open(PLACEHOLDER) as im:
+                self._save_thumbnail(im, width, fn)
+        return fn
+
+    def prefetch(self, codes):
+        """
+        Downloads, in the background thread pool, the photos of codes that are not cached yet
+        Returns the futures of the downloads it started or that were already in flight, e.g. to wait for them
+        """
+        futures = []
+        with self._lock:
+            for code in codes:
+                code = int(code)
+                if code in self._missing or os.path.exists(self._file(code)):
+                    continue
+                future = self._pending.get(code)
+                if future is None:
+                    future = self._pending[code] = self._pool.submit(self._fetch, code)
+                    future.add_done_callback(lambda _, code=code: self._done(code))
+                futures.append(future)
+        return futures
+
+    def _done(self, code):
+        with self._lock:
+            self._pending.pop(code, None)
+
+    def _fetch(self, code):
+        """ Downloads the photo of code and its thumbnails, returns False when it could not be downloaded """
+        endpoint = PHOTO_ENDPOINT.format(code)
+        try:
+            content = self._download(endpoint)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                self._missing.add(code)
+            return False
+        except FileNotFoundError:
+            self._missing.add(code)
+            return False
+        except (requests.RequestException, OSError):
+            return False  # tried again on the next prefetch
+
+        if self.record and self.base_url is not None:
+            self._write(os.path.join(self.record_path, *endpoint.split('/')), content)
+        if Image is not None:
+            with Image.open(io.BytesIO(content)) as im:
+                for width in self.widths:
+                    self._save_thumbnail(im, width, self._file(code, width))
+        # the original is written last, prefetch and photo take it as the sign that the photo is complete
+        self._write(self._file(code), content)
+        return True
+
+    def _download(self, endpoint):
+        if self.base_url is None:
+            with open(os.path.join(self.record_path, *endpoint.split('/')), 'rb') as f:
+                return f.read()
+        r = self.session.get("{}/{}".format(self.base_url, endpoint), timeout=10)
+        r.raise_for_status()
+        return r.content
+
+    def _file(self, code, width=None):
+        if width is None or Image is None:
+            return os.path.join(self.path, "p{}.png".format(code))
+        return os.path.join(self.path, "p{}-w{}.png".format(code, width))
+
+    @staticmethod
+    def _write(fn, content):
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp_file = "{}.{}.tmp".format(fn, threading.get_ident())  # sessions may write the same placeholder
+        with open(tmp_file, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_file, fn)
+
+    @staticmethod
+    def _save_thumbnail(im, width, fn):
+        height = max(1, round(im.height * width / im.width))
+        buffer = io.BytesIO()
+        im.resize((width, height), Image.LANCZOS).save(buffer, format='PNG', optimize=True)
+        PhotoCache._write(fn, buffer.getvalue())
+
+
+_photo_cache = None
+
+
+def photo_cache():
+    """ PhotoCache shared by every session, created on first use """
+    global _photo_cache
+    if _photo_cache is None:
+        _photo_cache = PhotoCache()
+    return _photo_cache
+
+
+def main(workers):
+    players = get_player_table(wrap_fpl(FPLData(convert_to_dataframes=True)))
+    photos = PhotoCache(workers=workers)
+    start = time.perf_counter()
+    futures = photos.prefetch(players.codes)
+    wait(futures)
+    n_ok = sum(f.result() for f in futures)
+    print("{} photos downloaded, {} failed, {} already cached, in {:.1f} s".format(
+        n_ok, len(futures) - n_ok, len(players) - len(futures), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=PREFETCH_WORKERS, help="concurrent downloads")
+    args = parser.parse_args()
+
+    main(workers=args.workers)
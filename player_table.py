@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+# bootstrap columns kept as float32, the ones missing from a snapshot are skipped
+NUMERIC_COLUMNS = ['now_cost', 'ep_this', 'ep_next', 'form', 'selected_by_percent', 'total_points', 'bonus',
+                   'dreamteam_count', 'chance_of_playing_next_round', 'points_per_game',
+                   'transfers_in', 'transfers_out', 'transfers_in_event', 'transfers_out_event',
+                   'team_strength', 'team_strength_overall_home', 'team_strength_overall_away',
+                   'team_strength_attack_home', 'team_strength_attack_away',
+                   'team_strength_defence_home', 'team_strength_defence_away']
+# small integer columns kept as int16
+CODE_COLUMNS = ['element_type', 'team', 'team_code']
+# names kept as categories
+CATEGORY_COLUMNS = ['team_name', 'team_short_name', 'type_name', 'type_name_short']
+# free text, only turned into a DataFrame when asked for
+TEXT_COLUMNS = ['web_name', 'first_name', 'second_name', 'full_name']
+
+
+class PlayerTable:
+    """
+    Compact, typed copy of the players of a snapshot, built once and shared read only by every page and session
+    Numeric columns are float32 arrays, positions and teams int16 arrays, names categoricals, and the free text
+    columns a side table materialised on first use
+    version: key of the snapshot the table was built from, e.g. for cache keys
+    ids: element id of every player, codes: player code of every player (the index of frame())
+    """
+
+    def __init__(self, ids, codes, columns, text, version):
+        self.ids = ids
+        self.codes = codes
+        self.columns = columns
+        self.version = version
+        self._text = text
+        self._text_frame = None
+        self._frame = None
+
+    @classmethod
+    def from_elements(cls, df_elements, version):
+        """ Builds the table from the df_elements of get_data (indexed by element id) """
+        columns = {}
+        for col in NUMERIC_COLUMNS:
+            if col in df_elements:
+                columns[col] = pd.to_numeric(df_elements[col], errors='coerce').to_numpy(np.float32)
+        for col in CODE_COLUMNS:
+            if col in df_elements:
+                columns[col] = df_elements[col].to_numpy(np.int16)
+        for col in CATEGORY_COLUMNS:
+            if col in df_elements:
+                columns[col] = pd.Categorical(df_elements[col])
+        for v in columns.values():
+            if isinstance(v, np.ndarray):
+                v.flags.writeable = False
+
+        text = {col: df_elements[col].to_numpy(dtype=object) for col in TEXT_COLUMNS if col in df_elements}
+        return cls(ids=df_elements.index.to_numpy(np.int32), codes=df_elements.code.to_numpy(np.int32),
+                   columns=columns, text=text, version=version)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def index(self):
+        return pd.Index(self.codes, name='code')
+
+    @property
+    def text(self):
+        """ Free text columns (web_name, full_name, ...) indexed by code """
+        if self._text_frame is None:
+            self._text_frame = pd.DataFrame(self._text, index=self.index)
+        return self._text_frame
+
+    @property
+    def nbytes(self):
+        """ Memory held by the typed columns (the text side table is not counted) """
+        return sum(v.nbytes for v in self.columns.values()) + self.ids.nbytes + self.codes.nbytes
+
+    def frame(self):
+        """
+        All columns as a DataFrame indexed by code, the input of the solvers, samplers and evaluators
+        The frame is built once and shared: filter it (df[mask]) or copy it before adding columns
+        """
+        if self._frame is None:
+            self._frame = pd.concat([pd.DataFrame(dict(self.columns, element=self.ids), index=self.index),
+                                     self.text], axis=1)
+        return self._frame
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from get_data import CACHE_DIR
+from squad_solver import canonical
+
+SOLUTION_DIR = os.path.join(CACHE_DIR, 'solutions')
+SOLUTION_LRU_SIZE = 256
+SOLUTION_DISK_SIZE = 5000  # pickles kept on disk, the least recently used ones are removed first
+
+
+def solution_key(version, **config):
+    """
+    Hash of everything a recommendation depends on: the snapshot version (see PlayerTable.version) and the
+    config the page solved with (weights, budgets, current squad, n_transfers, ...). Lists are compared as sets and
+    dicts by their items, so the same config always gets the same key
+    """
+    h = hashlib.sha1("version={!r};".format(canonical(version)).encode())
+    for k in sorted(config):
+        h.update("{}={!r};".format(k, canonical(config[k])).encode())
+    return h.hexdigest()
+
+
+class SolutionCache:
+    """
+    Two tier cache of solved recommendations, keyed by solution_key
+    memory: LRU of max_size entries shared by every session of the process
+    disk: one pickle per entry under path, at most max_disk_size of them, so a restart keeps the solved configs
+    hits, misses: lookups since the process started
+    """
+
+    def __init__(self, path=SOLUTION_DIR, max_size=SOLUTION_LRU_SIZE, max_disk_size=SOLUTION_DISK_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._lru.get(key)
+            if value is None:
+                value = self._read(key)
+                if value is not None:
+                    self._remember(key, value)
+            else:
+                self._lru.move_to_end(key)
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = self._file(key) + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, self._file(key))
+            self._prune_disk()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def clear(self):
+        """ Drops every entry from memory and disk """
+        with self._lock:
+            self._lru.clear()
+            for fn in self._files_on_disk():
+                os.remove(fn)
+
+    def _remember(self, key, value):
+        self._lru[key] = value
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _file(self, key):
+        return os.path.join(self.path, "{}.pkl".format(key))
+
+    def _read(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        os.utime(self._file(key))  # the mtime orders the disk entries by last use
+        return value
+
+    def _files_on_disk(self):
+        if not os.path.isdir(self.path):
+            return []
+        return [os.path.join(self.path, fn) for fn in os.listdir(self.path) if fn.endswith('.pkl')]
+
+    def _prune_disk(self):
+        files = self._files_on_disk()
+        if len(files) <= self.max_disk_size:
+            return
+        files.sort(key=os.path.getmtime)
+        for fn in files[:len(files) - self.max_disk_size]:
+            os.remove(fn)
+
+
+_solution_cache = None
+
+
+def solution_cache():
+    """ SolutionCache shared by every session, created on first use """
+    global _solution_cache
+    if _solution_cache is None:
+        _solution_cache = SolutionCache()
+    return _solution_cache
@@ -0,0 +1,990 @@
+import hashlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+import pulp
+from scipy import sparse
+
+from perf import span
+
+try:
+    from scipy.optimize import Bounds, LinearConstraint, linprog, milp
+except ImportError:  # scipy < 1.9, only the pulp backend is available
+    milp = linprog = None
+
+MAP_POS_NUM = {'Goalkeeper': 1, 'Defender': 2, 'Midfielder': 3, 'Forward': 4}
+PROCESS_POOL_WORKERS = min(8, os.cpu_count() or 1)
+IMPROVE_TIME_LIMIT = 120  # seconds a background solve keeps improving an incumbent the page's time budget cut short
+MAX_BACKGROUND_SOLVES = PROCESS_POOL_WORKERS  # background solves running at once, over every session
+TOP_K_WINDOW = 0.005  # share of the LP bound below it solve_top_k first looks for the k best squads in
+PRUNE_CHUNK = 1024  # players compared with every other player of their position at a time in prune_dominated
+
+
+class SquadModel:
+    """
+    0/1 squad selection problem in matrix form: row_lb <= A @ x <= row_ub, x binary
+    codes: player code of every column of A
+    A: scipy sparse matrix (n_rows x n_players * len(block_names))
+    row_lb, row_ub: numpy arrays with the bounds of each row
+    row_names: name of each row, used as constraint names in pulp
+    block_names: models with several roles per player (e.g. lineup and bench) have one block of columns per role
+    var_ub: upper bound of every column, 0 for players that cannot be picked
+    keep_row: index of the row keeping total_players - n_transfers of the current squad, if any
+    extra_names: integer columns after the player blocks that are not tied to a player (e.g. transfer counts)
+    """
+
+    def __init__(self, codes, A, row_lb, row_ub, row_names, block_names=('x',), var_ub=None, keep_row=None,
+                 extra_names=()):
+        self.codes = codes
+        self.A = A
+        self.row_lb = row_lb
+        self.row_ub = row_ub
+        self.row_names = row_names
+        self.block_names = list(block_names)
+        self.extra_names = list(extra_names)
+        self.var_ub = np.ones(A.shape[1]) if var_ub is None else np.asarray(var_ub, dtype=float)
+        self.keep_row = keep_row
+
+    @property
+    def n_vars(self):
+        return self.A.shape[1]
+
+    def var_names(self):
+        return ["{}_{}".format(block, code) for block in self.block_names for code in self.codes] + self.extra_names
+
+    def selected(self, x, block=0):
+        """ Codes of the players picked in solution vector x (in the given block of columns) """
+        n = len(self.codes)
+        return list(self.codes[np.asarray(x)[block * n:(block + 1) * n] > 0.5])
+
+    def with_transfers(self, total_players, n_transfers):
+        """ Same model keeping total_players - n_transfers of the current squad """
+        row_lb, row_ub = self.row_lb.copy(), self.row_ub.copy()
+        row_lb[self.keep_row] = row_ub[self.keep_row] = total_players - n_transfers
+        return SquadModel(self.codes, self.A, row_lb, row_ub, self.row_names, self.block_names, self.var_ub,
+                          self.keep_row, self.extra_names)
+
+    def restricted(self, keep):
+        """ Same model with the players outside keep (boolean mask over codes) fixed at 0 in every block """
+        columns = np.ones(self.n_vars, dtype=bool)
+        columns[:len(self.block_names) * len(self.codes)] = np.tile(np.asarray(keep, dtype=bool), len(self.block_names))
+        return self.fixed(columns)
+
+    def fixed(self, keep):
+        """ Same model with the columns outside keep (boolean mask over all columns) fixed at 0 """
+        return SquadModel(self.codes, self.A, self.row_lb, self.row_ub, self.row_names, self.block_names,
+                          self.var_ub * keep, self.keep_row, self.extra_names)
+
+    def picked(self, x):
+        """ Boolean mask of the players picked in any block of x """
+        n = len(self.codes)
+        return np.asarray(x)[:len(self.block_names) * n].reshape(len(self.block_names), n).sum(axis=0) > 0.5
+
+    def no_good_cut(self, x):
+        """
+        Row (cols, ub) that excludes the squad picked in x from later solves: at most len(squad) - 1 of
+        its players, in any role, can be picked again
+        """
+        picked = np.flatnonzero(self.picked(x))
+        n = len(self.codes)
+        return np.concatenate([picked + b * n for b in range(len(self.block_names))]), len(picked) - 1
+
+
+class _Rows:
+    """ Accumulates the sparse rows of a SquadModel with their bounds """
+
+    def __init__(self):
+        self.rows, self.cols, self.data = [], [], []
+        self.lb, self.ub, self.names = [], [], []
+
+    def add(self, cols, data, lb, ub, name):
+        self.rows.append(np.full(len(cols), len(self.lb)))
+        self.cols.append(cols)
+        self.data.append(np.broadcast_to(np.asarray(data, dtype=float), (len(cols),)))
+        self.lb.append(lb)
+        self.ub.append(ub)
+        self.names.append(name)
+
+    def add_each(self, cols, lb, ub, names, data=1):
+        """ One row per row of the cols matrix, with coefficients data (1 by default) and bounds lb, ub """
+        first = len(self.lb)
+        self.rows.append(np.repeat(np.arange(first, first + len(cols)), cols.shape[1]))
+        self.cols.append(cols.ravel())
+        self.data.append(np.broadcast_to(np.asarray(data, dtype=float), cols.shape).ravel())
+        self.lb += np.broadcast_to(lb, (len(cols),)).tolist()
+        self.ub += np.broadcast_to(ub, (len(cols),)).tolist()
+        self.names += list(names)
+
+    def model(self, codes, block_names=('x',), var_ub=None, extra_names=(), extra_ub=()):
+        """
+        var_ub: upper bound of the columns of one block, repeated for every block, or of all the block columns
+        extra_ub: upper bound of each of the extra_names columns
+        """
+        A = sparse.csr_matrix((np.concatenate(self.data), (np.concatenate(self.rows), np.concatenate(self.cols))),
+                              shape=(len(self.lb), len(codes) * len(block_names) + len(extra_names)))
+        if var_ub is not None or len(extra_names) > 0:
+            var_ub = np.ones(len(codes)) if var_ub is None else np.asarray(var_ub, dtype=float)
+            if len(var_ub) == len(codes):
+                var_ub = np.tile(var_ub, len(block_names))
+            var_ub = np.concatenate([var_ub, np.asarray(extra_ub, dtype=float)])
+        return SquadModel(codes=codes, A=A, row_lb=np.array(self.lb, dtype=float),
+                          row_ub=np.array(self.ub, dtype=float), row_names=self.names, block_names=block_names,
+                          var_ub=var_ub, extra_names=extra_names)
+
+
+def _available(df):
+    # chance of playing next round for all players is 100%; as column bounds this is the same as
+    # sum(chance * x) == 100 * total_players, but gives the solvers a much tighter relaxation
+    return (df.chance_of_playing_next_round.to_numpy(float) >= 100).astype(float)
+
+
+@span('build_model')
+def build_squad_model(df, budget, total_players, players_minmax, max_players_per_team, current_team=None,
+                      n_transfers=0):
+    """
+    Builds the constraints of solve_group as a sparse matrix straight from the dataframe columns
+    df: players indexed by code with now_cost, element_type, team_name and chance_of_playing_next_round
+    budget: max total now_cost
+    total_players: number of players to pick
+    players_minmax: dict with {position: (min, max)}
+    max_players_per_team: dict with {team_name: max players}
+    current_team: codes of the current squad, total_players - n_transfers of them are kept
+    """
+    codes = df.index.to_numpy()
+    all_cols = np.arange(len(codes))
+    rows = _Rows()
+
+    rows.add(all_cols, df.now_cost.to_numpy(float), -np.inf, budget, "Lineup budget")
+    rows.add(all_cols, 1, total_players, total_players, "Max {} lineup".format(total_players))
+
+    element_type = df.element_type.to_numpy()
+    for player_type, (min_val, max_val) in players_minmax.items():
+        rows.add(all_cols[element_type == MAP_POS_NUM[player_type]], 1, min_val, max_val,
+                 "{} to {} {} in lineup".format(min_val, max_val, player_type))
+
+    team_index, teams = pd.factorize(df.team_name)
+    for i, team in enumerate(teams):
+        rows.add(all_cols[team_index == i], 1, -np.inf, max_players_per_team[team],
+                 "Max {} players per team in {}".format(max_players_per_team[team], team))
+
+    if current_team is None:
+        return rows.model(codes, var_ub=_available(df))
+
+    rows.add(all_cols[np.isin(codes, current_team)], 1, total_players - n_transfers, total_players - n_transfers,
+             "Keeping all by {} players".format(n_transfers))
+    model = rows.model(codes, var_ub=_available(df))
+    model.keep_row = len(rows.lb) - 1
+    return model
+
+
+@span('build_model')
+def build_lineup_bench_model(df, squad_budget, lineup_budget, squad_players, lineup_minmax, max_players_per_team,
+                             lineup_total_players=11):
+    """
+    Joint model for a new squad: the first block of columns picks the lineup, the second one the bench
+    squad_budget: max now_cost of lineup and bench together
+    lineup_budget: max now_cost of the lineup
+    squad_players: dict with {position: number of players in the squad}
+    lineup_minmax: dict with {position: (min, max)} for the lineup formation
+    max_players_per_team: dict with {team_name: max players} over the whole squad
+    """
+    codes = df.index.to_numpy()
+    n = len(codes)
+    lineup_cols = np.arange(n)
+    squad_cols = np.arange(2 * n)  # lineup and bench columns of every player
+    squad_total_players = sum(squad_players.values())
+    rows = _Rows()
+
+    cost = df.now_cost.to_numpy(float)
+    rows.add(squad_cols, np.tile(cost, 2), -np.inf, squad_budget, "Squad budget")
+    rows.add(lineup_cols, cost, -np.inf, lineup_budget, "Lineup budget")
+    rows.add(squad_cols, 1, squad_total_players, squad_total_players, "{} in squad".format(squad_total_players))
+    rows.add(lineup_cols, 1, lineup_total_players, lineup_total_players,
+             "{} in lineup".format(lineup_total_players))
+
+    element_type = np.tile(df.element_type.to_numpy(), 2)
+    for player_type, n_players in squad_players.items():
+        rows.add(squad_cols[element_type == MAP_POS_NUM[player_type]], 1, n_players, n_players,
+                 "{} {} in squad".format(n_players, player_type))
+    for player_type, (min_val, max_val) in lineup_minmax.items():
+        rows.add(lineup_cols[element_type[:n] == MAP_POS_NUM[player_type]], 1, min_val, max_val,
+                 "{} to {} {} in lineup".format(min_val, max_val, player_type))
+
+    team_index, teams = pd.factorize(df.team_name)
+    team_index = np.tile(team_index, 2)
+    for i, team in enumerate(teams):
+        rows.add(squad_cols[team_index == i], 1, -np.inf, max_players_per_team[team],
+                 "Max {} players per team in {}".format(max_players_per_team[team], team))
+
+    # a player is either in the lineup or on the bench
+    rows.add_each(np.column_stack([lineup_cols, n + lineup_cols]), -np.inf, 1,
+                  ["One role for {}".format(code) for code in codes])
+
+    return rows.model(codes, block_names=('lineup', 'bench'), var_ub=_available(df))
+
+
+def objective_vector(df, weights):
+    """
+    Objective coefficient of every player: sum(w * col) for the {column: weight} pairs in weights
+    """
+    cols = list(weights)
+    return df[cols].to_numpy(float) @ np.array([weights[c] for c in cols], dtype=float)
+
+
+def _dominators(p, q, cost, obj):
+    """ Boolean matrix with the players q (columns) that dominate each player p (rows), see prune_dominated """
+    cheaper = cost[q][None, :] <= cost[p][:, None]
+    better = (obj[q][None, :, :] >= obj[p][:, None, :]).all(axis=2)
+    same = (cost[q][None, :] == cost[p][:, None]) & (obj[q][None, :, :] == obj[p][:, None, :]).all(axis=2)
+    return cheaper & better & (~same | (q[None, :] < p[:, None]))
+
+
+@span('prune')
+def prune_dominated(df, objectives, players_max, total_players, max_players_per_team, current_team=None, depth=1):
+    """
+    Mask of the players of df the squad models need: without the others the best squad (and the depth best ones)
+    is still the same
+    A player q dominates p when both play the same position, q can be picked and is not in current_team, costs no
+    more and is at least as good in every objective (ties go to the first in df). A squad with p has at most
+    players_max[position] - 1 of its dominators, and at most (total_players - 1) // cap other teams full, so p is
+    dropped when its dominators outside the largest of those teams leave depth of them free to take its place
+    objectives: objective vectors aligned with df, one per block of columns of the model
+    players_max: {position: most players of that position in a squad}
+    current_team: codes that are always kept; the transfer model has to keep some of them
+    Players that cannot be picked are dropped too, unless they are in current_team
+    """
+    available = _available(df) > 0
+    current = np.isin(df.index.to_numpy(), [] if current_team is None else current_team)
+    cost = df.now_cost.to_numpy(float)
+    obj = np.column_stack(objectives)
+    element_type = df.element_type.to_numpy()
+    team_index, teams = pd.factorize(df.team_name)
+    caps = np.array([max_players_per_team[team] for team in teams])
+    can_dominate = available & ~current & (caps[team_index] > 0)
+    n_full = (total_players - 1) // caps[caps > 0].min() if (caps > 0).any() else 0
+
+    keep = available | current
+    for player_type, max_players in players_max.items():
+        players = np.flatnonzero(element_type == MAP_POS_NUM[player_type])
+        dominators = players[can_dominate[players]]
+        candidates = players[keep[players] & ~current[players]]
+        need = max_players - 1 + depth
+
+        # teammates can always take p's place, so comparing within each team first settles most players for
+        # a fraction of the comparisons with the whole position
+        for i in np.unique(team_index[candidates]):
+            team_candidates = candidates[team_index[candidates] == i]
+            team_dominators = dominators[team_index[dominators] == i]
+            for start in range(0, len(team_candidates), PRUNE_CHUNK):
+                p = team_candidates[start:start + PRUNE_CHUNK]
+                keep[p[_dominators(p, team_dominators, cost, obj).sum(axis=1) >= need]] = False
+
+        candidates = candidates[keep[candidates]]
+        team_of = np.zeros((len(dominators), len(teams)), dtype=np.float32)
+        team_of[np.arange(len(dominators)), team_index[dominators]] = 1
+        for start in range(0, len(candidates), PRUNE_CHUNK):
+            p = candidates[start:start + PRUNE_CHUNK]
+            per_team = _dominators(p, dominators, cost, obj).astype(np.float32) @ team_of
+            total = per_team.sum(axis=1)
+            per_team[np.arange(len(p)), team_index[p]] = 0  # swapping within p's team never breaks its cap
+            blocked = -np.sort(-per_team, axis=1)[:, :n_full].sum(axis=1)
+            keep[p[total - blocked >= need]] = False
+    return keep
+
+
+@span('to_pulp')
+def to_pulp(model, c, name="squad", cols=None):
+    """
+    Hands the matrix rows of model to a pulp problem in bulk, returns (problem, variables)
+    cols: columns that get a variable, e.g. the ones not fixed at 0, by default all; variables are in their order
+    """
+    cols = np.arange(model.n_vars) if cols is None else np.asarray(cols)
+    var_names = model.var_names()
+    problem = pulp.LpProblem(name=name, sense=pulp.LpMaximize)
+    x = [pulp.LpVariable(var_names[j], lowBound=0, upBound=model.var_ub[j], cat=pulp.LpInteger) for j in cols]
+
+    A = model.A.tocsc()[:, cols].tocsr()
+    for i, row_name in enumerate(model.row_names):
+        start, end = A.indptr[i], A.indptr[i + 1]
+        lb, ub = model.row_lb[i], model.row_ub[i]
+        if start == end and lb <= 0 <= ub:
+            continue  # every column of the row was left out
+        expr = pulp.LpAffineExpression(zip([x[j] for j in A.indices[start:end]], A.data[start:end]))
+        if lb == ub:
+            problem += pulp.LpConstraint(expr, pulp.LpConstraintEQ, rhs=ub, name=row_name)
+            continue
+        if np.isfinite(lb):
+            problem += pulp.LpConstraint(expr, pulp.LpConstraintGE, rhs=lb, name=row_name + " (min)")
+        if np.isfinite(ub):
+            problem += pulp.LpConstraint(expr, pulp.LpConstraintLE, rhs=ub, name=row_name + " (max)")
+
+    problem.setObjective(pulp.LpAffineExpression(zip(x, np.asarray(c, dtype=float)[cols])))
+    return problem, x
+
+
+class SolveResult:
+    """
+    Outcome of a solver backend
+    codes: selected player codes, None when no solution was found
+    x: solution vector over the model columns
+    gap: relative gap between objective and the best bound, 0 when the solution is proven optimal
+    warm: the backend reused the problem it built for a previous solve (see the warm dict of solve_squad_model)
+    """
+
+    def __init__(self, codes, x, objective, status, backend, seconds, gap=0.0, warm=False):
+        self.codes = codes
+        self.x = x
+        self.objective = objective
+        self.status = status
+        self.backend = backend
+        self.seconds = seconds
+        self.gap = gap
+        self.warm = warm
+
+
+def relative_gap(objective, bound):
+    return max(0.0, bound - objective) / max(1.0, abs(bound))
+
+
+def _lp_relaxation(model, c):
+    return milp(-np.asarray(c, dtype=float), constraints=LinearConstraint(model.A, model.row_lb, model.row_ub),
+                integrality=np.zeros(model.n_vars), bounds=Bounds(0, model.var_ub))
+
+
+def lp_bound(model, c):
+    """ Upper bound on c @ x from the LP relaxation of model """
+    res = _lp_relaxation(model, c)
+    return -res.fun if res.success else np.inf
+
+
+def lp_reduced_costs(model, c, time_limit=None):
+    """
+    LP relaxation bound of model and the reduced cost of every column (<= 0): no squad picking column j scores more
+    than bound + reduced[j]
+    Returns (None, None) when the relaxation fails or time_limit seconds run out
+    """
+    A = model.A.tocsr()
+    upper, lower = np.isfinite(model.row_ub), np.isfinite(model.row_lb)
+    res = linprog(-np.asarray(c, dtype=float), A_ub=sparse.vstack([A[upper], -A[lower]]),
+                  b_ub=np.concatenate([model.row_ub[upper], -model.row_lb[lower]]),
+                  bounds=np.column_stack([np.zeros(model.n_vars), model.var_ub]), method='highs',
+                  options={} if time_limit is None else {'time_limit': time_limit})
+    if not res.success:
+        return None, None
+    return -res.fun, np.minimum(-res.lower.marginals, 0)
+
+
+def _greedy_fill(model, A, c, x, frugal):
+    """
+    Adds columns to x until every row reaches its lower bound, each step the column that fits every upper bound and
+    counts towards the most rows still under their lower bound; ties go to the best objective, or with frugal to the
+    column using the smallest share of the slack left under the upper bounds (e.g. the cheapest player)
+    Returns the filled x, None when no column fits
+    """
+    x = x.copy()
+    activity = A @ x
+    while True:
+        deficit = activity < model.row_lb - 1e-6
+        if not deficit.any():
+            return x
+        free = np.flatnonzero((x == 0) & (model.var_ub > 0))
+        if len(free) == 0:
+            return None
+        cols = A[:, free]
+        col = np.repeat(np.arange(len(free)), np.diff(cols.indptr))  # column of every nonzero
+        slack = model.row_ub - activity
+        fits = np.bincount(col, cols.data > slack[cols.indices] + 1e-6, minlength=len(free)) == 0
+        helps = np.bincount(col, deficit[cols.indices] & (cols.data > 0), minlength=len(free)) * fits
+        if helps.max() == 0:
+            return None
+        best = np.flatnonzero(helps == helps.max())
+        if frugal:
+            bounded = np.isfinite(slack) & (slack > 0)
+            share = np.where(bounded[cols.indices], cols.data / np.where(bounded, slack, 1)[cols.indices], 0)
+            i = best[np.argmin(np.bincount(col, share, minlength=len(free))[best])]
+        else:
+            i = best[np.argmax(c[free[best]])]
+        x[free[i]] = 1
+        activity += cols[:, [i]].toarray().ravel()
+
+
+@span('preview')
+def lp_preview(model, c):
+    """
+    Squad from the LP relaxation of model in a few milliseconds, to show while the MILP solves
+    The LP solution is rounded down, which keeps every row within its upper bound, and the places left are filled
+    greedily (see _greedy_fill), with the best players first and, when that runs out of budget, the cheapest
+    Returns a SolveResult with its gap to the LP bound, codes is None when the relaxation or the greedy fill fails
+    """
+    name = "LP preview"
+    start = time.perf_counter()
+    if milp is None:
+        return SolveResult(None, None, None, "scipy.optimize.milp is not available", name, 0.)
+    c = np.asarray(c, dtype=float)
+    res = _lp_relaxation(model, c)
+    if not res.success:
+        return SolveResult(None, None, None, res.message, name, time.perf_counter() - start)
+
+    A = model.A.tocsc()
+    rounded = (res.x > 1 - 1e-6).astype(float)
+    x = _greedy_fill(model, A, c, rounded, frugal=False)
+    if x is None:
+        x = _greedy_fill(model, A, c, rounded, frugal=True)
+    if x is None:
+        return SolveResult(None, None, None, "No feasible rounding", name, time.perf_counter() - start)
+
+    objective = float(c @ x)
+    return SolveResult(model.selected(x), x, objective, "Preview", name, time.perf_counter() - start,
+                       gap=relative_gap(objective, -res.fun))
+
+
+class PulpBackend:
+    """
+    Writes the model to an LP file and solves it with the CBC binary shipped with pulp
+    With a warm dict the pulp problem is built once (while the same columns are fixed at 0), later solves only swap
+    the objective and start CBC from the previous incumbent
+    """
+    name = "CBC (pulp)"
+
+    def solve(self, model, c, warm=None, time_limit=None):
+        start = time.perf_counter()
+        # columns fixed at 0 (unavailable or pruned players) get no pulp variable
+        free = np.flatnonzero(model.var_ub > 0)
+        reused = warm is not None and 'pulp' in warm and np.array_equal(warm['free'], free)
+        if reused:
+            problem, variables = warm['pulp']
+            problem.setObjective(pulp.LpAffineExpression(zip(variables, np.asarray(c, dtype=float)[free])))
+        else:
+            problem, variables = to_pulp(model, c, cols=free)
+            if warm is not None:
+                warm['pulp'], warm['free'] = (problem, variables), free
+
+        x0 = None if warm is None else warm.get('x')
+        if x0 is not None:
+            for v, val in zip(variables, x0[free]):
+                v.setInitialValue(val)
+
+        with span('cbc'):
+            status = problem.solve(pulp.PULP_CBC_CMD(msg=False, warmStart=x0 is not None, timeLimit=time_limit))
+        seconds = time.perf_counter() - start
+
+        if status != pulp.LpStatusOptimal or problem.sol_status not in (pulp.LpSolutionOptimal,
+                                                                         pulp.LpSolutionIntegerFeasible):
+            return SolveResult(None, None, None, pulp.LpStatus[status], self.name, seconds, warm=reused)
+
+        x = np.zeros(model.n_vars)
+        x[free] = [v.varValue or 0 for v in variables]
+        if warm is not None:
+            warm['x'] = x
+
+        # pulp does not report CBC's bound, a stopped solve is measured against the LP relaxation instead
+        objective = float(c @ x)
+        gap = 0.0
+        if problem.sol_status != pulp.LpSolutionOptimal and milp is not None:
+            gap = relative_gap(objective, lp_bound(model, c))
+        return SolveResult(model.selected(x), x, objective, pulp.LpStatus[status], self.name, seconds, gap=gap,
+                           warm=reused)
+
+    def solve_top_k(self, model, c, k, time_limit=None, exclude=()):
+        """
+        Adds a no-good cut to the same pulp problem after every solve, until k squads or time_limit seconds
+        exclude: solution vectors of squads that are cut off from the start
+        """
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        free = np.flatnonzero(model.var_ub > 0)
+        problem, variables = to_pulp(model, c, cols=free)
+
+        def cut(x_i):
+            cols, ub = model.no_good_cut(x_i)
+            cols = cols[model.var_ub[cols] > 0]  # a player's column in another block may be fixed at 0
+            problem.addConstraint(pulp.LpConstraint(pulp.lpSum(variables[j] for j in np.searchsorted(free, cols)),
+                                                    pulp.LpConstraintLE, rhs=ub),
+                                  name="No good cut {}".format(len(problem.constraints)))
+
+        for x_i in exclude:
+            cut(x_i)
+        results = []
+        for i in range(k):
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                break
+            start = time.perf_counter()
+            with span('cbc'):
+                status = problem.solve(pulp.PULP_CBC_CMD(msg=False, timeLimit=remaining))
+            seconds = time.perf_counter() - start
+            if status != pulp.LpStatusOptimal or problem.sol_status not in (pulp.LpSolutionOptimal,
+                                                                             pulp.LpSolutionIntegerFeasible):
+                break
+
+            x_i = np.zeros(model.n_vars)
+            x_i[free] = [v.varValue or 0 for v in variables]
+            objective = float(c @ x_i)
+            gap = 0.0
+            if problem.sol_status != pulp.LpSolutionOptimal and milp is not None:
+                gap = relative_gap(objective, lp_bound(model, c))
+            results.append(SolveResult(model.selected(x_i), x_i, objective, pulp.LpStatus[status], self.name,
+                                       seconds, gap=gap))
+            if gap > 0:
+                break  # the time limit stopped this solve, there is no time left for the next one
+
+            cut(x_i)
+        return results
+
+
+class HighsBackend:
+    """
+    Solves the model arrays in process with HiGHS through scipy.optimize.milp
+    scipy takes no initial solution, so a warm dict only keeps the constraint object between solves (while the same
+    columns are fixed at 0)
+    """
+    name = "HiGHS (scipy)"
+
+    def solve(self, model, c, warm=None, time_limit=None):
+        start = time.perf_counter()
+        # columns fixed at 0 (unavailable or pruned players) are left out of the problem HiGHS gets
+        free = np.flatnonzero(model.var_ub > 0)
+        reused = warm is not None and 'constraints' in warm and np.array_equal(warm['free'], free)
+        if reused:
+            constraints = warm['constraints']
+        else:
+            constraints = LinearConstraint(model.A.tocsc()[:, free], model.row_lb, model.row_ub)
+            if warm is not None:
+                warm['constraints'], warm['free'] = constraints, free
+
+        with span('highs'):
+            res = milp(-np.asarray(c, dtype=float)[free],
+                       constraints=constraints,
+                       integrality=np.ones(len(free)),
+                       bounds=Bounds(0, model.var_ub[free]),
+                       options={} if time_limit is None else {'time_limit': time_limit})
+        seconds = time.perf_counter() - start
+
+        # status 1 is the time limit, res.x then holds the best incumbent (if any was found)
+        if res.x is None or res.status not in (0, 1):
+            return SolveResult(None, None, None, res.message, self.name, seconds, warm=reused)
+
+        x = np.zeros(model.n_vars)
+        x[free] = np.round(res.x)
+        if warm is not None:
+            warm['x'] = x
+        gap = 0.0 if res.status == 0 else relative_gap(float(c @ x), -res.mip_dual_bound)
+        return SolveResult(model.selected(x), x, float(c @ x), res.message, self.name, seconds, gap=gap,
+                           warm=reused)
+
+    def solve_top_k(self, model, c, k, time_limit=None, exclude=()):
+        """
+        Keeps the model constraints and grows a second constraint block with one no-good cut per solve, until k
+        squads or time_limit seconds
+        exclude: solution vectors of squads that are cut off from the start
+        """
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        free = np.flatnonzero(model.var_ub > 0)
+        base = LinearConstraint(model.A.tocsc()[:, free], model.row_lb, model.row_ub)
+        cut_rows, cut_cols, cut_ub = [], [], []
+
+        def cut(x_i):
+            cols, ub = model.no_good_cut(x_i)
+            cols = cols[model.var_ub[cols] > 0]  # a player's column in another block may be fixed at 0
+            cut_rows.extend([len(cut_ub)] * len(cols))
+            cut_cols.extend(np.searchsorted(free, cols))
+            cut_ub.append(ub)
+
+        for x_i in exclude:
+            cut(x_i)
+        results = []
+        for i in range(k):
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                break
+            constraints = [base]
+            if len(cut_ub) > 0:
+                cuts = sparse.csr_matrix((np.ones(len(cut_cols)), (cut_rows, cut_cols)),
+                                         shape=(len(cut_ub), len(free)))
+                constraints.append(LinearConstraint(cuts, -np.inf, cut_ub))
+
+            start = time.perf_counter()
+            with span('highs'):
+                res = milp(-np.asarray(c, dtype=float)[free], constraints=constraints, integrality=np.ones(len(free)),
+                           bounds=Bounds(0, model.var_ub[free]),
+                           options={} if remaining is None else {'time_limit': remaining})
+            seconds = time.perf_counter() - start
+            if res.x is None or res.status not in (0, 1):
+                break
+
+            x_i = np.zeros(model.n_vars)
+            x_i[free] = np.round(res.x)
+            gap = 0.0 if res.status == 0 else relative_gap(float(c @ x_i), -res.mip_dual_bound)
+            results.append(SolveResult(model.selected(x_i), x_i, float(c @ x_i), res.message, self.name, seconds,
+                                       gap=gap))
+            if res.status == 1:
+                break  # the time limit stopped this solve, there is no time left for the next one
+
+            cut(x_i)
+        return results
+
+
+SOLVER_BACKENDS = {b.name: b for b in ([HighsBackend()] if milp is not None else []) + [PulpBackend()]}
+
+
+def solve_squad_model(model, c, backend=None, warm=None, time_limit=None):
+    """
+    Maximises c @ x subject to model
+    backend: name in SOLVER_BACKENDS, defaults to the first available one (HiGHS, with pulp as fallback)
+    warm: dict where the backend keeps its state between solves of the same model
+    time_limit: seconds after which the best incumbent found so far is returned, with its gap
+    """
+    if backend not in SOLVER_BACKENDS:
+        backend = next(iter(SOLVER_BACKENDS))
+    with span('solve'):
+        return SOLVER_BACKENDS[backend].solve(model, c, warm=warm, time_limit=time_limit)
+
+
+def solve_top_k(model, c, k, backend=None, time_limit=None):
+    """
+    The k best distinct squads of model, best first (see SquadSolver.top_k)
+    Every no-good cut makes the next MILP as slow as a cold solve, so the backend only enumerates the columns that
+    can be in a squad scoring within a window of the LP bound (reduced cost fixing, see lp_reduced_costs). The squads
+    it finds above bound - window are then the true best ones; while fewer than k are, the window doubles
+    """
+    if backend not in SOLVER_BACKENDS:
+        backend = next(iter(SOLVER_BACKENDS))
+    solver = SOLVER_BACKENDS[backend]
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    bound, reduced = lp_reduced_costs(model, c, time_limit=time_limit) if linprog is not None else (None, None)
+    if bound is None:
+        remaining = None if deadline is None else deadline - time.perf_counter()
+        return [] if remaining is not None and remaining <= 0 else solver.solve_top_k(model, c, k, time_limit=remaining)
+
+    scale = max(1.0, abs(bound))
+    window = TOP_K_WINDOW * scale
+    ranked = []  # squads known to be the best ones, they stay cut off when the window widens
+    while True:
+        keep = reduced >= -window - 1e-6 * scale
+        remaining = None if deadline is None else max(0., deadline - time.perf_counter())
+        results = ranked + solver.solve_top_k(model.fixed(keep), c, k - len(ranked), time_limit=remaining,
+                                              exclude=[r.x for r in ranked])
+        if keep[model.var_ub > 0].all():
+            return results  # nothing was fixed, these are the squads of the whole model
+
+        floor = bound - window
+        n_exact = next((i for i, r in enumerate(results) if r.gap > 0 or r.objective < floor - 1e-6 * scale),
+                       len(results))
+        if n_exact == k or (deadline is not None and time.perf_counter() >= deadline):
+            # squads below the floor are not known to be the next best ones: some squad of the fixed columns may
+            # score up to the floor
+            for r in results[n_exact:]:
+                r.gap = max(r.gap, relative_gap(r.objective, floor))
+            return results
+        ranked = results[:n_exact]
+        window *= 2
+
+
+def canonical(v):
+    """
+    Same value for equivalent inputs, to hash them: dicts become their sorted items, lists and sets their sorted
+    values and numpy scalars python ones; tuples keep their order (e.g. (min, max) pairs)
+    """
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, dict):
+        return sorted((k, canonical(_v)) for k, _v in v.items())
+    if isinstance(v, (list, set, np.ndarray, pd.Index)):
+        return sorted(canonical(_v) for _v in v)
+    if isinstance(v, tuple):
+        return tuple(canonical(_v) for _v in v)
+    return v
+
+
+def constraint_key(df, **inputs):
+    """
+    Hash of everything a squad model is built from: the player columns used in the constraints and the inputs
+    (budget, excluded teams through df, current squad, n_transfers, ...), but none of the objective weights
+    """
+    h = hashlib.sha1()
+    cols = [c for c in ['now_cost', 'element_type', 'team_name', 'chance_of_playing_next_round'] if c in df]
+    h.update(pd.util.hash_pandas_object(df[cols]).to_numpy().tobytes())
+    for k in sorted(inputs):
+        h.update("{}={!r};".format(k, canonical(inputs[k])).encode())
+    return h.hexdigest()
+
+
+class SquadSolver:
+    """
+    A built squad model kept between reruns (e.g. in st.session_state)
+    Moving a weight slider does not change the feasible region, so solve only swaps the objective vector and
+    the backend starts from the previous incumbent; players pruned for the weights (keep) are fixed at 0 in the same
+    model, so pruning does not rebuild it either
+    key: constraint_key of the inputs the model was built from
+    """
+
+    def __init__(self, model, key):
+        self.model = model
+        self.key = key
+        self.n_solves = 0
+        self._warm = {}
+
+    def start_from(self, x):
+        """ Initial incumbent for the next solve, e.g. a plan known to be feasible """
+        self._warm['x'] = np.asarray(x, dtype=float)
+
+    def restricted(self, keep=None):
+        """ The model with the players outside keep (mask over model.codes, e.g. from prune_dominated) fixed at 0 """
+        return self.model if keep is None else self.model.restricted(keep)
+
+    def solve(self, c, backend=None, time_limit=None, keep=None):
+        if backend != self._warm.get('backend'):
+            self._warm = {'backend': backend, 'x': self._warm.get('x')}
+        self.n_solves += 1
+        return solve_squad_model(self.restricted(keep), c, backend=backend, warm=self._warm, time_limit=time_limit)
+
+    def top_k(self, c, k, backend=None, time_limit=None, keep=None):
+        """
+        The k best distinct squads, best first (fewer if the model runs out of feasible squads or time_limit seconds
+        run out; the squad being solved when they do is returned with its gap)
+        """
+        self.n_solves += 1
+        with span('solve_top_k'):
+            return solve_top_k(self.restricted(keep), c, k, backend=backend, time_limit=time_limit)
+
+
+def squad_differences(model, results, names):
+    """
+    Table of the ranked squads in results and how each one differs from the best one
+    names: series with the player name of every code
+    """
+    best = model.picked(results[0].x)
+    rows = []
+    for rank, result in enumerate(results, start=1):
+        picked = model.picked(result.x)
+        rows.append(dict(rank=rank,
+                         objective=result.objective,
+                         objective_gap=results[0].objective - result.objective,
+                         players_out=", ".join(names.loc[model.codes[best & ~picked]]),
+                         players_in=", ".join(names.loc[model.codes[picked & ~best]])))
+    return pd.DataFrame(rows).set_index('rank')
+
+
+def get_squad_solver(store, name, key, build):
+    """
+    Returns the SquadSolver kept in store[name], rebuilding it with build() when key changed
+    store: dict like object that survives reruns, e.g. st.session_state
+    """
+    solver = store.get(name)
+    if solver is None or solver.key != key:
+        solver = SquadSolver(build(), key)
+        store[name] = solver
+    return solver
+
+
+_process_pool = None
+
+
+def process_pool():
+    """ Worker processes shared by every session, started on first use """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS)
+    return _process_pool
+
+
+def _solve_in_worker(model, c, backend, time_limit=None):
+    return solve_squad_model(model, c, backend=backend, time_limit=time_limit)
+
+
+def submit_solve(model, c, backend=None, time_limit=None):
+    """ Solves model in the shared process pool (see solve_squad_model), returns the future of the SolveResult """
+    return process_pool().submit(_solve_in_worker, model, c, backend, time_limit)
+
+
+def _solve_in_process(conn, model, c, backend, time_limit):
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()  # a process group of its own, so stopping it also stops the CBC process it starts
+    conn.send(solve_squad_model(model, c, backend=backend, time_limit=time_limit))
+    conn.close()
+
+
+_background_solves = set()
+_background_lock = threading.Lock()
+
+
+class BackgroundSolve:
+    """
+    Solve of model in a process of its own, outside the shared pool, so it can be stopped while it runs (neither
+    solver can be interrupted in a pool worker)
+    future: gets the SolveResult, or a CancelledError once the solve was stopped
+    """
+
+    def __init__(self, model, c, backend=None, time_limit=None):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=_solve_in_process, args=(sender, model, c, backend, time_limit),
+                                               name='background-solve', daemon=True)
+        self.process.start()
+        sender.close()
+        self.future = Future()
+        self.future.set_running_or_notify_cancel()
+        threading.Thread(target=self._wait, args=(receiver,), name='background-solve', daemon=True).start()
+
+    def _wait(self, receiver):
+        try:
+            result = receiver.recv()
+        except (EOFError, OSError):  # stopped, or the process died
+            self.future.set_exception(CancelledError())
+        else:
+            self.future.set_result(result)
+        finally:
+            receiver.close()
+            self.process.join()
+            with _background_lock:
+                _background_solves.discard(self)
+
+    def stop(self):
+        with _background_lock:
+            _background_solves.discard(self)  # its place goes to the next solve at once
+        if not self.process.is_alive():
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (AttributeError, ProcessLookupError, PermissionError):  # no process groups, or not set up yet
+            self.process.terminate()
+
+
+def stop_improvement(store, name, unless=None):
+    """ Stops the background solve in store[name] (see improve_in_background), unless it is the one of config unless """
+    entry = store.get(name)
+    if entry is not None and entry[0] != unless:
+        entry[1].stop()
+        store[name] = None
+
+
+def improve_in_background(store, name, key, model, c, backend=None, time_limit=IMPROVE_TIME_LIMIT, on_done=None):
+    """
+    Solves model again in the background with a longer time_limit, e.g. after a solve stopped by the page's time
+    budget. Returns the future of the SolveResult, kept with key in store[name] so the reruns of the same config
+    (key) get the same future instead of starting another solve, and None when MAX_BACKGROUND_SOLVES are running
+    A session keeps one improvement in store[name]: the one of another config is stopped, also while it runs
+    on_done: called with the SolveResult when it arrives, in a thread of this process
+    """
+    entry = store.get(name)
+    if entry is not None and entry[0] == key:
+        return entry[1].future
+    stop_improvement(store, name)
+
+    with _background_lock:
+        if len(_background_solves) >= MAX_BACKGROUND_SOLVES:
+            return None
+        solve = BackgroundSolve(model, c, backend=backend, time_limit=time_limit)
+        _background_solves.add(solve)
+
+    def done(f):
+        if f.exception() is None:
+            on_done(f.result())
+
+    if on_done is not None:
+        solve.future.add_done_callback(done)
+    store[name] = (key, solve)
+    return solve.future
+
+
+def sweep_transfers(model, c, df, total_players, max_transfers, transfers_limit, transfers_cost, current_ep,
+                    backend=None):
+    """
+    Solves the transfer model for n_transfers = 0..max_transfers in worker processes
+    df: players indexed by code, aligned with model.codes, with ep_next and web_name
+    transfers_limit, transfers_cost: free transfers and points per extra transfer, as in my_team['transfers']
+    current_ep: ep_next of the current squad
+    Returns a table with the expected points gain against the point cost of every n_transfers, flagging the
+    pareto frontier (no other option gains more for less) and the option with the best net gain
+    """
+    futures = {n: submit_solve(model.with_transfers(total_players, n), c, backend=backend)
+               for n in range(max_transfers + 1)}
+
+    current = np.zeros(len(model.codes), dtype=bool)
+    current[model.A[model.keep_row].indices] = True
+    ep_next = df.ep_next.to_numpy(float)
+
+    rows = []
+    for n, future in futures.items():
+        result = future.result()
+        if result.codes is None:
+            continue
+        picked = model.picked(result.x)
+        ep_gain = ep_next[picked].sum() - current_ep
+        point_cost = max(0, (n - transfers_limit) * transfers_cost)
+        rows.append(dict(n_transfers=n,
+                         ep_gain=ep_gain,
+                         point_cost=point_cost,
+                         net_gain=ep_gain - point_cost,
+                         players_out=", ".join(df.web_name.to_numpy()[current & ~picked]),
+                         players_in=", ".join(df.web_name.to_numpy()[picked & ~current])))
+
+    sweep = pd.DataFrame(rows, columns=['n_transfers', 'ep_gain', 'point_cost', 'net_gain', 'players_out',
+                                        'players_in'])
+    sweep['pareto'] = [not ((sweep.point_cost <= r.point_cost) & (sweep.ep_gain >= r.ep_gain) &
+                            ((sweep.point_cost < r.point_cost) | (sweep.ep_gain > r.ep_gain))).any()
+                       for r in sweep.itertuples()]
+    sweep['best'] = sweep.index == sweep.net_gain.idxmax() if len(sweep) > 0 else []
+    return sweep.set_index('n_transfers')
+
+
+def sample_weights(weights, n_samples, spread=0.25, rng=None):
+    """
+    n_samples weight dicts around weights: each weight moves by a normal step with a standard deviation of spread
+    times the largest weight, and is clipped at 0
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    cols = list(weights)
+    w = np.array([weights[c] for c in cols], dtype=float)
+    samples = np.clip(w + rng.normal(0, spread * max(1., np.abs(w).max()), (n_samples, len(cols))), 0, None)
+    return [dict(zip(cols, sample)) for sample in samples]
+
+
+def _solve_many_in_worker(model, objectives, backend, deadline):
+    # one SquadSolver per chunk, so the backend state is built once and only the objective changes between solves
+    solver = SquadSolver(model, key=None)
+    n = len(model.block_names) * len(model.codes)
+    picked = []
+    for c in objectives:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        # the solve in progress stops at the deadline too; a squad it did not prove optimal is not counted
+        result = solver.solve(c, backend=backend, time_limit=remaining)
+        if result.x is not None and result.gap == 0:
+            picked.append(result.x[:n] > 0.5)
+    return np.array(picked, dtype=bool).reshape(-1, n)
+
+
+def weight_robustness(model, objectives, backend=None, time_limit=10.):
+    """
+    Solves model for every row of objectives (e.g. from sample_weights) in the process pool
+    Rows are handed out in chunks so every worker reuses the constraints of the model; every solve stops at
+    time_limit seconds from the start, so no worker is kept busy after that
+    Returns (frequency, n_solved): frequency has the share of solves that picked each player (rows, by code) in each
+    block of the model, and in any of them (column squad)
+    """
+    deadline = time.time() + time_limit
+    chunks = np.array_split(np.asarray(objectives, dtype=float), min(len(objectives), 4 * PROCESS_POOL_WORKERS))
+    futures = [process_pool().submit(_solve_many_in_worker, model, chunk, backend, deadline) for chunk in chunks]
+
+    # workers stop at the deadline, the margin covers handing out the chunks and the solver shutting down
+    done, not_done = wait(futures, timeout=time_limit + 10)
+    for future in not_done:
+        future.cancel()
+
+    n_blocks, n = len(model.block_names), len(model.codes)
+    picked = np.concatenate([np.zeros((0, n_blocks * n), dtype=bool)] + [f.result() for f in done])
+    frequency = pd.DataFrame(picked.reshape(-1, n_blocks, n).mean(axis=0).T if len(picked) > 0 else 0.,
+                             index=pd.Index(model.codes, name='code'), columns=model.block_names)
+    frequency['squad'] = frequency[model.block_names].sum(axis=1)
+    return frequency, len(picked)
+
+
+def consensus_squad(model, frequency, backend=None):
+    """ The squad of model whose players (in each block) were picked most often in the robustness samples """
+    return solve_squad_model(model, frequency[model.block_names].to_numpy().T.ravel(), backend=backend)
@@ -0,0 +1,173 @@
+"""
+Seeded synthetic FPL bootstrap data, shaped like fetch_info() of FPLData(convert_to_dataframes=True): elements,
+teams, element_types and events DataFrames, with the same columns and string encoded numbers as the API
+
+    python synthetic_data.py --players 5000 --out .cache/roboklopp/recordings
+
+writes <out>/api/bootstrap-static.json, to replay with ROBOKLOPP_FPL_MODE=replay (directly or through
+fpl_stub_server.py). In python, SyntheticFPL(n_players) can be passed to get_data like an FPLData object.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from get_data import RECORD_DIR, _to_payload
+
+SIZES = dict(small=700, medium=5000, large=50000)
+N_TEAMS = 20
+N_EVENTS = 38
+POSITION_SHARE = [0.1, 0.33, 0.42, 0.15]  # goalkeepers, defenders, midfielders, forwards, as in a real season
+POSITION_COST = [(40, 60), (40, 70), (45, 130), (45, 140)]  # now_cost range per position
+ELEMENT_TYPES = [(1, 'Goalkeeper', 'Goalkeepers', 'GKP', 2, 1, 1),
+                 (2, 'Defender', 'Defenders', 'DEF', 5, 3, 5),
+                 (3, 'Midfielder', 'Midfielders', 'MID', 5, 2, 5),
+                 (4, 'Forward', 'Forwards', 'FWD', 3, 1, 3)]
+
+
+def _teams(rng, n_teams):
+    strength = rng.integers(2, 6, n_teams)
+    home = 1000 + 60 * strength + rng.integers(-40, 40, (6, n_teams))
+    return pd.DataFrame(dict(id=np.arange(1, n_teams + 1),
+                             code=np.arange(1, n_teams + 1) * 3,
+                             name=["Team {}".format(i) for i in range(1, n_teams + 1)],
+                             short_name=["T{:02d}".format(i) for i in range(1, n_teams + 1)],
+                             strength=strength,
+                             strength_overall_home=home[0], strength_overall_away=home[1] - 30,
+                             strength_attack_home=home[2], strength_attack_away=home[3] - 30,
+                             strength_defence_home=home[4], strength_defence_away=home[5] - 30,
+                             played=0, win=0, draw=0, loss=0, points=0, position=0, form=None,
+                             pulse_id=np.arange(1, n_teams + 1) + 100,
+                             unavailable=False))
+
+
+def _element_types(elements):
+    df = pd.DataFrame(ELEMENT_TYPES, columns=['id', 'singular_name', 'plural_name', 'singular_name_short',
+                                              'squad_select', 'squad_min_play', 'squad_max_play'])
+    df['element_count'] = elements.element_type.value_counts().reindex(df.id, fill_value=0).to_numpy()
+    return df
+
+
+def _events(game_week):
+    ids = np.arange(1, N_EVENTS + 1)
+    deadlines = pd.Timestamp('2024-08-16T17:30:00Z') + pd.to_timedelta(7 * (ids - 1), unit='D')
+    return pd.DataFrame(dict(id=ids,
+                             name=["Gameweek {}".format(i) for i in ids],
+                             deadline_time=deadlines.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                             finished=ids < game_week,
+                             is_previous=ids == game_week - 1,
+                             is_current=ids == game_week - 1,
+                             is_next=ids == game_week))
+
+
+def _elements(rng, n_players, teams, game_week):
+    element_type = rng.choice([1, 2, 3, 4], n_players, p=POSITION_SHARE)
+    team = rng.integers(1, len(teams) + 1, n_players)
+    team_strength = teams.strength.to_numpy()[team - 1]
+
+    # cost and quality go together, stronger teams have better players
+    low, high = np.array(POSITION_COST).T
+    quality = np.clip(rng.beta(2, 5, n_players) + 0.05 * (team_strength - 3), 0, 1)
+    now_cost = (low[element_type - 1] + quality * (high[element_type - 1] - low[element_type - 1])) // 5 * 5
+    played = rng.random(n_players) < 0.7
+    points_per_game = np.where(played, np.round(1 + 6 * quality + rng.normal(0, 0.8, n_players), 1), 0).clip(0)
+    total_points = np.round(points_per_game * (game_week - 1) * rng.uniform(0.6, 1, n_players)).astype(int)
+    form = np.round(np.clip(points_per_game + rng.normal(0, 1.5, n_players), 0, None), 1)
+    ep_next = np.round(np.clip(0.6 * points_per_game + 0.4 * form + rng.normal(0, 0.5, n_players), 0, None), 1)
+    selected = np.round(np.clip(rng.lognormal(-0.5, 1.5, n_players) * (0.2 + quality), 0, 90), 1)
+
+    doubtful = rng.random(n_players) < 0.08
+    chance = np.where(doubtful, rng.choice([0, 25, 50, 75], n_players), np.nan)
+    status = np.where(~doubtful, 'a', np.where(chance == 0, 'i', 'd'))
+
+    ids = np.arange(1, n_players + 1)
+    transfers_in = rng.integers(0, 10 ** 6, n_players) * played
+    return pd.DataFrame(dict(id=ids,
+                             code=100000 + rng.permutation(10 * n_players)[:n_players],
+                             first_name=["First{}".format(i) for i in ids],
+                             second_name=["Second{}".format(i) for i in ids],
+                             web_name=["Player{}".format(i) for i in ids],
+                             element_type=element_type,
+                             team=team,
+                             team_code=teams.code.to_numpy()[team - 1],
+                             status=status,
+                             news=np.where(doubtful, "Knock - 50% chance of playing", ""),
+                             chance_of_playing_next_round=chance,
+                             chance_of_playing_this_round=chance,
+                             now_cost=now_cost.astype(int),
+                             cost_change_event=0,
+                             cost_change_start=rng.integers(-3, 4, n_players),
+                             total_points=total_points,
+                             event_points=rng.integers(0, 12, n_players) * played,
+                             points_per_game=points_per_game.astype(str),
+                             form=form.astype(str),
+                             ep_next=ep_next.astype(str),
+                             ep_this=np.round(np.clip(ep_next + rng.normal(0, 0.3, n_players), 0, None), 1).astype(str),
+                             selected_by_percent=selected.astype(str),
+                             value_form=np.round(form / now_cost * 10, 1).astype(str),
+                             value_season=np.round(total_points / now_cost * 10, 1).astype(str),
+                             minutes=np.round(total_points * rng.uniform(10, 30, n_players)).astype(int),
+                             goals_scored=rng.poisson(quality * (element_type - 1), n_players),
+                             assists=rng.poisson(quality * 2, n_players),
+                             clean_sheets=rng.poisson(played * (element_type <= 2) * 2, n_players),
+                             bonus=rng.poisson(quality * 8 * played, n_players),
+                             bps=rng.integers(0, 500, n_players) * played,
+                             dreamteam_count=rng.poisson(quality * 1.5 * played, n_players),
+                             in_dreamteam=False,
+                             influence=np.round(rng.uniform(0, 500, n_players) * played, 1).astype(str),
+                             creativity=np.round(rng.uniform(0, 500, n_players) * played, 1).astype(str),
+                             threat=np.round(rng.uniform(0, 500, n_players) * played, 1).astype(str),
+                             ict_index=np.round(rng.uniform(0, 150, n_players) * played, 1).astype(str),
+                             transfers_in=transfers_in,
+                             transfers_out=rng.integers(0, 10 ** 6, n_players) * played,
+                             transfers_in_event=transfers_in // 10,
+                             transfers_out_event=rng.integers(0, 10 ** 5, n_players) * played,
+                             special=False,
+                             photo=["{}.jpg".format(c) for c in ids]))
+
+
+def make_info(n_players=SIZES['small'], seed=0, n_teams=N_TEAMS, game_week=5):
+    """
+    Bootstrap data of n_players players (see SIZES) in n_teams teams, before game week game_week
+    The same seed always gives the same data
+    """
+    rng = np.random.default_rng(seed)
+    teams = _teams(rng, n_teams)
+    elements = _elements(rng, n_players, teams, game_week)
+    return dict(events=_events(game_week),
+                teams=teams,
+                elements=elements,
+                element_types=_element_types(elements),
+                total_players=int(n_players * 15000))
+
+
+class SyntheticFPL:
+    """ Stand-in for FPLData that serves make_info(n_players, seed) as its bootstrap data """
+
+    def __init__(self, n_players=SIZES['small'], seed=0, **kwargs):
+        self.n_players = n_players
+        self.seed = seed
+        self.kwargs = kwargs
+
+    def fetch_info(self):
+        return make_info(self.n_players, seed=self.seed, **self.kwargs)
+
+
+def main(n_players, seed, out):
+    fn = os.path.join(out, 'api', 'bootstrap-static.json')
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    with open(fn, 'w') as f:
+        json.dump(_to_payload(make_info(n_players, seed=seed)), f)
+    print("{} players written to {}".format(n_players, fn))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, default=SIZES['small'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=RECORD_DIR, help="recordings directory")
+    args = parser.parse_args()
+
+    main(n_players=args.players, seed=args.seed, out=args.out)
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from get_data import _build_snapshot  # noqa: E402
+from player_table import PlayerTable  # noqa: E402
+from synthetic_data import make_info  # noqa: E402
+
+SQUAD_PLAYERS = {1: 2, 2: 5, 3: 5, 4: 3}
+
+
+def make_players(n_players, seed=0):
+    """ Synthetic players indexed by code, with numeric columns and a random weights column """
+    df = make_info(n_players, seed=seed)['elements'].set_index('code')
+    for col in ['now_cost', 'total_points', 'ep_this', 'ep_next', 'form', 'selected_by_percent']:
+        df[col] = df[col].astype(float)
+    df['weights'] = np.random.default_rng(seed).random(len(df))
+    return df
+
+
+def make_table(n_players, seed=0):
+    """ PlayerTable frame of synthetic players, as the pages get it """
+    df_elements = _build_snapshot(make_info(n_players, seed=seed))[2]
+    return PlayerTable.from_elements(df_elements, version=(0, 'synthetic-{}-{}'.format(n_players, seed))).frame()
+
+
+def cheap_squad(df, max_per_team=3):
+    """ The cheapest 2/5/5/3 squad with at most max_per_team players per team, and the free slots of every team """
+    codes, per_team = [], {}
+    for element_type, n in SQUAD_PLAYERS.items():
+        picked = 0
+        for code in df[df.element_type == element_type].sort_values('now_cost', kind='stable').index:
+            if picked == n:
+                break
+            if per_team.get(df.team[code], 0) < max_per_team:
+                codes.append(code)
+                per_team[df.team[code]] = per_team.get(df.team[code], 0) + 1
+                picked += 1
+    teams = {t: max_per_team - per_team.get(t, 0) for t in df.team.unique()}
+    return df.loc[codes], teams
+
+
+@pytest.fixture
+def players():
+    return make_players(300)
+
+
+@pytest.fixture
+def table():
+    return make_table(300)
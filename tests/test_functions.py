@@ -0,0 +1,107 @@
+import itertools
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import cheap_squad, make_players
+from functions import SquadEvaluator, eval_team, multi_transfers, single_transfers, squad_transfer
+
+
+def column_of(df, codes, col):
+    """ df[col] of an array of player codes, in its shape """
+    return df[col].loc[codes.ravel()].to_numpy().reshape(codes.shape)
+
+
+def brute_force_transfers(df, squad, teams, n_transfers, extra_budget):
+    """ Every feasible set of n_transfers transfers, as a list of (gain, players out, players in) """
+    others = df.drop(squad.index)
+    res = []
+    for out in itertools.combinations(squad.index, n_transfers):
+        out = list(out)
+        groups = [np.array(list(itertools.combinations(others.index[others.element_type == p], k))).reshape(-1, k)
+                  for p, k in Counter(df.element_type[out]).items()]
+        players_in = np.array([np.concatenate(ins) for ins in itertools.product(*groups)]).reshape(-1, n_transfers)
+        if len(players_in) == 0:
+            continue
+        slots = Counter(teams) + Counter(df.team[out])
+        in_team = column_of(df, players_in, 'team')
+        same_team = (in_team[:, :, None] == in_team[:, None, :]).sum(axis=2)
+        fits = ((column_of(df, players_in, 'now_cost').sum(axis=1) <= extra_budget + df.now_cost[out].sum()) &
+                (same_team <= np.vectorize(slots.__getitem__)(in_team)).all(axis=1))
+        gains = column_of(df, players_in, 'weights').sum(axis=1) - df.weights[out].sum()
+        res += [(g, tuple(out), tuple(ins)) for g, ins in zip(gains[fits], players_in[fits])]
+    return res
+
+
+def test_transfers_with_a_squad_player_filtered_out_of_df(players):
+    squad, teams = cheap_squad(players)
+    gone = squad.index[3]
+    df = players.drop(gone)
+
+    res = single_transfers(df, squad, teams, top_n=5, extra_budget=5)
+    assert set(res.elements_out.str[0]) == set(squad.index)
+    # a player comes from df, or is the one leaving (keeping him); the one missing from df cannot be kept
+    kept = res.elements_in == res.elements_out
+    assert not res.elements_in[~kept].str[0].isin(squad.index).any()
+    assert gone not in set(res.elements_in.str[0])
+    for r in res.itertuples(index=False):
+        new_squad = pd.concat([squad.drop(list(r.elements_out)), players.loc[list(r.elements_in)]])
+        expected = eval_team(new_squad, col_prefixes=['weights', 'transfers_'])
+        assert np.allclose([getattr(r, k) for k in expected], list(expected.values()), equal_nan=True)
+
+    new_squads = squad_transfer(df, squad, teams, top_n=5, extra_budget=5)
+    for new_squad, _ in new_squads:
+        assert new_squad.index.is_unique and len(new_squad) == len(squad)
+        assert len(squad.index.difference(new_squad.index)) <= 1
+    res = multi_transfers(df, squad, teams, n_transfers=2, top_n=20, extra_budget=5)
+    assert set(res.elements_out.sum()) <= set(squad.index)
+    assert set(res.elements_in.sum()).isdisjoint(squad.index)
+
+
+def test_transfers_name_missing_players_without_their_columns(players):
+    squad, teams = cheap_squad(players)
+    gone = squad.index[3]
+    with pytest.raises(ValueError, match=str(gone)):
+        single_transfers(players.drop(gone), squad.drop(columns='weights'), teams)
+
+
+@pytest.mark.parametrize('n_transfers, n_players', [(2, 120), (3, 60)])
+def test_multi_transfers_matches_brute_force(n_transfers, n_players):
+    df = make_players(n_players, seed=n_transfers)
+    squad, teams = cheap_squad(df)
+    # half the teams closed, so the team slots bind
+    teams = {team: min(slots, 1) if i % 2 else 0 for i, (team, slots) in enumerate(teams.items())}
+    top_n = 15
+
+    res = multi_transfers(df, squad, teams, n_transfers=n_transfers, top_n=top_n, extra_budget=5)
+    feasible = brute_force_transfers(df, squad, teams, n_transfers, extra_budget=5)
+
+    assert np.allclose(res.gain, sorted((gain for gain, _, _ in feasible), reverse=True)[:top_n])
+    feasible = {(frozenset(out), frozenset(players_in)): gain for gain, out, players_in in feasible}
+    for r in res.itertuples(index=False):
+        assert feasible[(frozenset(r.elements_out), frozenset(r.elements_in))] == pytest.approx(r.gain)
+
+
+def test_squad_evaluator_matches_eval_team(players):
+    rng = np.random.default_rng(1)
+    players = players.copy()
+    players.loc[players.index[::7], 'ep_next'] = np.nan  # eval_team counts missing ep as 0 and skips them in means
+    players.loc[players.index[::11], 'form'] = np.nan
+    squads = np.array([rng.choice(players.index, 15, replace=False) for _ in range(20)])
+    evaluator = SquadEvaluator(players, col_prefixes=['weights', 'transfers_'])
+
+    for squad, metrics in zip(squads, evaluator.evaluate(squads)):
+        expected = eval_team(players.loc[squad], col_prefixes=['weights', 'transfers_'])
+        assert evaluator.metrics == list(expected)
+        assert np.allclose(metrics, list(expected.values()), equal_nan=True)
+
+    others = players.index.difference(squads[0])
+    players_out = np.array([rng.choice(squads[0], 2, replace=False) for _ in range(10)])
+    players_in = np.array([rng.choice(others, 2, replace=False) for _ in range(10)])
+    swapped = evaluator.evaluate_swaps(squads[0], players_out, players_in)
+    for out, incoming, metrics in zip(players_out, players_in, swapped):
+        new_squad = pd.concat([players.loc[squads[0]].drop(out), players.loc[incoming]])
+        expected = eval_team(new_squad, col_prefixes=['weights', 'transfers_'])
+        assert np.allclose(metrics, list(expected.values()), equal_nan=True)
@@ -0,0 +1,29 @@
+import json
+import os
+
+import pandas as pd
+
+from get_data import RecordReplayFPL
+
+
+class ManagersFPL:
+    """ fetch_managers as FPLData(convert_to_dataframes=True) returns it: one dataframe per manager """
+
+    def fetch_managers(self, managers):
+        return {m: pd.DataFrame([dict(id=int(m), name="Squad {}".format(m), player_first_name="First",
+                                      player_last_name="Last")]) for m in managers}
+
+
+def test_recorded_managers_replay_next_to_the_entry_payload(tmp_path):
+    # the raw api/entry/<id> payload, as batch_recommend.PublicFPL records it
+    entry_file = tmp_path / 'api' / 'entry' / '7.json'
+    entry_file.parent.mkdir(parents=True)
+    entry_file.write_text(json.dumps(dict(id=7, name="Squad 7", player_first_name="First")))
+
+    recorded = RecordReplayFPL(ManagersFPL(), mode='record', path=str(tmp_path), url=None).fetch_managers(['7'])
+    replayed = RecordReplayFPL(None, mode='replay', path=str(tmp_path), url=None).fetch_managers(['7'])
+
+    pd.testing.assert_frame_equal(replayed['7'], recorded['7'])
+    assert replayed['7'].iloc[0]['name'] == "Squad 7"
+    assert json.loads(entry_file.read_text())['id'] == 7  # the entry payload was not overwritten
+    assert os.path.isfile(tmp_path / 'api' / 'entry' / '7' / 'summary.json')
@@ -0,0 +1,61 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("streamlit")  # new_team_config, imported by new_team_functions, draws its sidebar with it
+
+from functions import eval_team  # noqa: E402
+from new_team_functions import combine_and_pick_top, get_squad_prod  # noqa: E402
+
+PICK_GROUPS = {'Stars': dict(players={'Midfielder': 2, 'Forward': 1}, budget=360),
+               'Bench': dict(players={'Goalkeeper': 1, 'Defender': 1}, budget=120)}
+
+
+def pick_groups_df(df):
+    for group in PICK_GROUPS:
+        df['w_' + group] = df['weights'] + 1e-3
+    return df
+
+
+def test_get_squad_prod_picks_every_group_without_sharing_players(players):
+    df = pick_groups_df(players)
+    picked = get_squad_prod(df, list(PICK_GROUPS), PICK_GROUPS, {t: 3 for t in df.team_code.unique()}, top_n=3,
+                            ndraws_per_group=20, rng=np.random.default_rng(0))
+
+    assert list(picked) == list(PICK_GROUPS)
+    for group, squads in picked.items():
+        assert 0 < len(squads) <= 3
+        assert all(len(squad) == sum(PICK_GROUPS[group]['players'].values()) for squad in squads)
+    stars = set().union(*(squad.index for squad in picked['Stars']))
+    bench = set().union(*(squad.index for squad in picked['Bench']))
+    assert not stars & bench
+
+
+def test_get_squad_prod_names_the_group_without_a_pick(players):
+    df = pick_groups_df(players)
+    groups = dict(PICK_GROUPS, Bench=dict(PICK_GROUPS['Bench'], budget=-1000))
+    with pytest.raises(ValueError, match="Bench"):
+        get_squad_prod(df, list(groups), groups, {t: 3 for t in df.team_code.unique()}, top_n=3, ndraws_per_group=20,
+                       rng=np.random.default_rng(0))
+
+
+@pytest.mark.parametrize('by_order', [['points', 'cost'], 'avg_form'])
+def test_combine_and_pick_top_matches_full_enumeration(players, by_order):
+    rng = np.random.default_rng(2)
+    codes = iter(rng.permutation(players.index))
+    comb_squad = {group: [players.loc[[next(codes) for _ in range(size)]] for _ in range(n_candidates)]
+                  for group, size, n_candidates in [('Stars', 3, 7), ('Mids', 4, 6), ('Bench', 2, 5)]}
+    keys = [by_order] if isinstance(by_order, str) else by_order
+    top_n = 12
+
+    def key(squad):
+        metrics = eval_team(squad)
+        return tuple(metrics[k] for k in keys)
+
+    every_key = [key(pd.concat(squads)) for squads in itertools.product(*comb_squad.values())]
+    picked = combine_and_pick_top(comb_squad, by_order, top_n=top_n)
+
+    assert len(picked) == top_n
+    assert np.allclose([key(squad) for squad in picked], sorted(every_key, reverse=True)[:top_n])
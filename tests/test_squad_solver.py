@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from squad_solver import SOLVER_BACKENDS, SquadSolver, build_squad_model, objective_vector, prune_dominated
+
+WEIGHTS = dict(total_points=10, now_cost=1, ep_next=5, form=3, selected_by_percent=3, bonus=1, dreamteam_count=1)
+SQUAD_PLAYERS = {'Goalkeeper': (2, 2), 'Defender': (5, 5), 'Midfielder': (5, 5), 'Forward': (3, 3)}
+
+
+def squad_model(df):
+    return build_squad_model(df=df, budget=1000, total_players=15, players_minmax=SQUAD_PLAYERS,
+                             max_players_per_team={team: 3 for team in df.team_name.unique()})
+
+
+def prune(df, c, depth=1):
+    return prune_dominated(df, [c], {p: v[1] for p, v in SQUAD_PLAYERS.items()}, 15,
+                           {team: 3 for team in df.team_name.unique()}, depth=depth)
+
+
+@pytest.mark.parametrize('backend', list(SOLVER_BACKENDS))
+def test_solve_is_warm_only_when_the_problem_is_reused(table, backend):
+    solver = SquadSolver(squad_model(table), key=None)
+    c = objective_vector(table, WEIGHTS)
+    keep = prune(table, c)
+
+    first = solver.solve(c, backend=backend, keep=keep)
+    again = solver.solve(c * 1.01, backend=backend, keep=keep)
+    other_keep = solver.solve(c, backend=backend, keep=np.ones(len(table), dtype=bool))
+    top_k = solver.top_k(c, 2, backend=backend, keep=keep)
+
+    assert not first.warm
+    assert again.warm
+    assert not other_keep.warm
+    assert not any(r.warm for r in top_k)
+    assert first.objective == pytest.approx(other_keep.objective)
+
+
+@pytest.mark.parametrize('backend', list(SOLVER_BACKENDS))
+def test_pruned_top_k_matches_the_full_model(table, backend):
+    c = objective_vector(table, WEIGHTS)
+    k = 3
+    keep = prune(table, c, depth=k)
+
+    full = SquadSolver(squad_model(table), key=None).top_k(c, k, backend=backend)
+    pruned = SquadSolver(squad_model(table), key=None).top_k(c, k, backend=backend, keep=keep)
+
+    assert keep.sum() < len(table)
+    assert len(full) == len(pruned) == k
+    assert [r.objective for r in pruned] == pytest.approx([r.objective for r in full])
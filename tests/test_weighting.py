@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("streamlit")  # weighting asks for the weights with sidebar sliders
+
+from conftest import make_table  # noqa: E402
+from weighting import MinMaxScaler, PlayerWeights, weight_func  # noqa: E402
+
+CONFIGS = [dict(add=dict(ep_this=100, ep_next=70, now_cost=30, total_points=50, selected_by_percent=5,
+                         transfers_in_out=50, form=50),
+                mult=dict(chance_of_playing_next_round=10)),
+           dict(add=dict(total_points=10, team_strength_attack=3, form=-2), mult=dict()),
+           dict(add=dict(ep_next=5, transfers_in_out_event=1), mult=dict(chance_of_playing_next_round=2, form=3))]
+
+
+def test_apply_many_matches_weight_func():
+    df = make_table(200, seed=4)
+    pw = PlayerWeights(df, weight_func_args=CONFIGS[0])
+    expected = [MinMaxScaler().fit_transform(weight_func(pw.df_metrics, config['add'], mult=config['mult']))
+                for config in CONFIGS]
+
+    res = pw.apply_many([pw.weight_vector(config['add']) for config in CONFIGS],
+                        mult=[pw.weight_vector(config['mult']) for config in CONFIGS])
+
+    assert res.shape == (len(df), len(CONFIGS))
+    for j, s in enumerate(expected):
+        assert np.allclose(res[j], s)
+    assert np.allclose(pw.apply(), expected[0])
+    assert pw.apply().index.equals(df.index)
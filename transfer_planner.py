@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+from perf import span
+from squad_solver import (MAP_POS_NUM, SolveResult, _available, _Rows, lp_bound, milp, relative_gap)
+
+MAX_FREE_TRANSFERS = 5  # free transfers that can be banked
+PROJECTION_DECAY = 0.7  # weight of ep_next against form one week further ahead
+
+
+@span('build_model')
+def build_plan_model(df, current_team, budget, total_players, players_minmax, max_players_per_team, horizon,
+                     transfers_limit, max_free_transfers=MAX_FREE_TRANSFERS):
+    """
+    Transfer plan over the next horizon game weeks as one SquadModel
+    Per week t there is a squad block (gw<t>) with the same constraints as build_squad_model, and a transfers block
+    (in_gw<t>) with the players bought that week: squad_t <= squad_t-1 + in_t
+    Extra columns per week: free_gw<t> (free transfers available), used_gw<t> (free transfers used) and
+    hits_gw<t> (transfers paid with points), with free_t+1 <= free_t - used_t + 1 for the carry-over
+    current_team: codes of the current squad
+    transfers_limit: free transfers available in the first week, as in my_team['transfers']
+    """
+    codes = df.index.to_numpy()
+    n = len(codes)
+    all_cols = np.arange(n)
+    current = np.isin(codes, current_team).astype(float)
+    cost = df.now_cost.to_numpy(float)
+    element_type = df.element_type.to_numpy()
+    team_index, teams = pd.factorize(df.team_name)
+    n_blocks = 2 * horizon
+    free_ub = max(max_free_transfers, transfers_limit)
+
+    def squad(t):
+        return t * n + all_cols
+
+    def bought(t):
+        return (horizon + t) * n + all_cols
+
+    def extra(t, i):
+        return n_blocks * n + 3 * t + i
+
+    rows = _Rows()
+    for t in range(horizon):
+        week = "week {}".format(t + 1)
+        rows.add(squad(t), cost, -np.inf, budget, "Budget {}".format(week))
+        rows.add(squad(t), 1, total_players, total_players, "{} players {}".format(total_players, week))
+        for player_type, (min_val, max_val) in players_minmax.items():
+            rows.add(squad(t)[element_type == MAP_POS_NUM[player_type]], 1, min_val, max_val,
+                     "{} to {} {} {}".format(min_val, max_val, player_type, week))
+        for i, team in enumerate(teams):
+            rows.add(squad(t)[team_index == i], 1, -np.inf, max_players_per_team[team],
+                     "Max {} players per team in {} {}".format(max_players_per_team[team], team, week))
+
+        # a player is only in the squad if he was in it the week before or was bought this week
+        if t == 0:
+            rows.add_each(np.column_stack([squad(t), bought(t)]), -np.inf, current,
+                          ["Keep or buy {} {}".format(code, week) for code in codes], data=[1, -1])
+        else:
+            rows.add_each(np.column_stack([squad(t), bought(t), squad(t - 1)]), -np.inf, 0,
+                          ["Keep or buy {} {}".format(code, week) for code in codes], data=[1, -1, -1])
+
+        rows.add(np.concatenate([bought(t), [extra(t, 1), extra(t, 2)]]), np.concatenate([np.ones(n), [-1, -1]]),
+                 -np.inf, 0, "Transfers are free or hits {}".format(week))
+        rows.add(np.array([extra(t, 1), extra(t, 0)]), [1, -1], -np.inf, 0, "Free transfers used {}".format(week))
+        if t == 0:
+            rows.add(np.array([extra(t, 0)]), 1, transfers_limit, transfers_limit, "Free transfers {}".format(week))
+        else:
+            rows.add(np.array([extra(t, 0), extra(t - 1, 0), extra(t - 1, 1)]), [1, -1, 1], -np.inf, 1,
+                     "Free transfers carried to {}".format(week))
+
+    # chance of playing only restricts the first week, later weeks discount it in the projections
+    var_ub = np.concatenate([_available(df), np.ones((n_blocks - 1) * n)])
+    extra_names = ["{}_gw{}".format(name, t + 1) for t in range(horizon) for name in ('free', 'used', 'hits')]
+    extra_ub = [free_ub, free_ub, total_players] * horizon
+    return rows.model(codes, block_names=["gw{}".format(t + 1) for t in range(horizon)] +
+                                         ["in_gw{}".format(t + 1) for t in range(horizon)],
+                      var_ub=var_ub, extra_names=extra_names, extra_ub=extra_ub)
+
+
+def weekly_projections(df, horizon, decay=PROJECTION_DECAY):
+    """
+    Expected points of every player (columns) for each of the next horizon weeks (rows)
+    The first week is ep_next; later weeks blend towards form, and players doubtful for the next round are assumed
+    to recover at the same rate
+    FPL bootstrap data has no fixture difficulty, so any fixture based projection of the same shape can be used
+    instead of this one
+    """
+    ep_next = df.ep_next.to_numpy(float)
+    form = df.form.to_numpy(float)
+    chance = df.chance_of_playing_next_round.to_numpy(float) / 100
+    w = decay ** np.arange(horizon)[:, None]
+    return (w * ep_next + (1 - w) * form) * (1 - (1 - chance) * w)
+
+
+def plan_objective(model, projections, hit_cost):
+    """ Objective vector of a plan model: projected points of every week minus hit_cost per hit """
+    horizon, n = projections.shape
+    hits = np.tile([0, 0, -hit_cost], horizon)
+    return np.concatenate([np.asarray(projections, dtype=float).ravel(), np.zeros(horizon * n), hits])
+
+
+def hold_plan(model, current_team, transfers_limit, max_free_transfers=MAX_FREE_TRANSFERS):
+    """ Solution vector that keeps the current squad and banks every free transfer """
+    n = len(model.codes)
+    horizon = len(model.block_names) // 2
+    x = np.zeros(model.n_vars)
+    x[:horizon * n] = np.tile(np.isin(model.codes, current_team), horizon)
+    for t in range(horizon):
+        free = transfers_limit if t == 0 else min(max(max_free_transfers, transfers_limit), free + 1)
+        x[2 * horizon * n + 3 * t] = free
+    return x
+
+
+def _feasible(model, x):
+    Ax = model.A @ x
+    return bool(np.all(Ax >= model.row_lb - 1e-6) and np.all(Ax <= model.row_ub + 1e-6) and
+                np.all(x <= model.var_ub + 1e-6))
+
+
+def plan_transfers(solver, projections, hit_cost, current_team, transfers_limit, backend=None, time_limit=None):
+    """
+    Solves the plan model kept in solver (a SquadSolver over build_plan_model)
+    The first solve starts from holding the current squad; later ones from the previous plan. When the time limit
+    stops the solver before it finds any plan, holding the current squad is returned if it is feasible
+    """
+    x0 = hold_plan(solver.model, current_team, transfers_limit)
+    if solver.n_solves == 0:
+        solver.start_from(x0)
+
+    c = plan_objective(solver.model, projections, hit_cost)
+    result = solver.solve(c, backend=backend, time_limit=time_limit)
+    if result.codes is not None or not _feasible(solver.model, x0):
+        return result
+
+    gap = relative_gap(float(c @ x0), lp_bound(solver.model, c)) if milp is not None else np.nan
+    return SolveResult(solver.model.selected(x0), x0, float(c @ x0), "{} (holding the current squad)".format(
+        result.status), result.backend, result.seconds, gap=gap)
+
+
+def plan_table(model, x, names, projections, hit_cost, current_team, transfers_limit,
+               max_free_transfers=MAX_FREE_TRANSFERS):
+    """
+    One row per week of the plan in x: transfers, free transfers, hits and projected points of the squad
+    Free transfers and hits are counted from the squads, the solver is free to leave slack in those columns
+    names: series with the player name of every code
+    """
+    n = len(model.codes)
+    horizon = len(model.block_names) // 2
+    squads = np.asarray(x)[:horizon * n].reshape(horizon, n) > 0.5
+    previous = np.vstack([np.isin(model.codes, current_team), squads[:-1]])
+    rows = []
+    free = transfers_limit
+    for t in range(horizon):
+        players_in = squads[t] & ~previous[t]
+        transfers = int(players_in.sum())
+        hits = max(0, transfers - free)
+        rows.append(dict(week=t + 1,
+                         free_transfers=free,
+                         transfers=transfers,
+                         hits=hits,
+                         projected_points=projections[t] @ squads[t] - hit_cost * hits,
+                         players_out=", ".join(names.loc[model.codes[previous[t] & ~squads[t]]]),
+                         players_in=", ".join(names.loc[model.codes[players_in]])))
+        free = min(max(max_free_transfers, transfers_limit), max(0, free - transfers) + 1)
+    return pd.DataFrame(rows).set_index('week')
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -44,17 +45,46 @@ class MinMaxScaler:
 
 
 class PlayerWeights:
-    def __init__(self, df_elements):
+    def __init__(self, df_elements, weight_func_args=None):
+        """ weight_func_args: dict(add=..., mult=...) to use instead of asking for them with sidebar sliders """
+        self._metrics = None  # df_metrics as a float matrix, built on the first apply
         self._build_metrics(df_elements)
-        self._get_weights()
+        if weight_func_args is None:
+            self._get_weights()
+        else:
+            self.weight_func_args = weight_func_args
 
     def apply(self):
-        weights = weight_func(self.df_metrics, **self.weight_func_args)
-
-        # normalise
-        scaler = MinMaxScaler()
-        weights = scaler.fit_transform(weights)
-        return weights
+        add, mult = self.weight_func_args['add'], self.weight_func_args['mult']
+        weights = self.apply_many([self.weight_vector(add)], mult=[self.weight_vector(mult)])
+        return weights[0].rename(None)
+
+    def weight_vector(self, weights: dict):
+        """ {metric: weight} as a row of the weight matrices of apply_many (0 for the metrics not in weights) """
+        return np.array([weights.get(col, 0) for col in self.df_metrics.columns], dtype=float)
+
+    def apply_many(self, W, mult=None):
+        """
+        Player weights of many configurations at once, each one the same as apply() with its own sliders
+        W: matrix (n_configs x n_metrics) of add weights, columns in the order of df_metrics (see weight_vector)
+        mult: matrix of the same shape with the weights to multiply by (0 where a metric does not multiply),
+              as the mult dict of weight_func
+        Returns a DataFrame with the min-max normalised weights of every player (rows) for every config (columns)
+        """
+        if self._metrics is None:
+            self._metrics = self.df_metrics.to_numpy(float)
+        X = self._metrics
+        W = np.atleast_2d(np.asarray(W, dtype=float))
+
+        s = W @ X.T
+        if mult is not None:
+            mult = np.atleast_2d(np.asarray(mult, dtype=float))
+            for j in np.flatnonzero((mult != 0).any(axis=0)):
+                s *= np.where(mult[:, j:j + 1] != 0, mult[:, j:j + 1] * X[:, j], 1)
+
+        # normalise every config, as MinMaxScaler does
+        s_min, s_max = s.min(axis=1, keepdims=True), s.max(axis=1, keepdims=True)
+        return pd.DataFrame(((s - s_min) / (s_max - s_min)).T, index=self.df_metrics.index)
 
     def _get_weights(self):
         _original_val = dict(ep_this=100,